@@ -20,3 +20,24 @@ export function connectVehicle(vehicleId, onMessage) {
   return ws;
 }
 
+// Un solo socket para toda la flota del usuario: cada frame trae
+// {vehicles: [...]} y cada elemento sólo los campos que cambiaron (+ vehicle_id)
+export function connectFleet(onMessage) {
+  const proto = window.location.protocol === 'https:' ? 'wss' : 'ws';
+  const url = `${proto}://${window.location.host}/ws/fleet/`;
+  let ws = new WebSocket(url);
+
+  ws.onopen = () => console.log('WS connected for fleet');
+  ws.onmessage = (evt) => {
+    try {
+      const data = JSON.parse(evt.data);
+      (data.vehicles || []).forEach(onMessage);
+    } catch (e) { console.error('WS parse error', e); }
+  };
+  ws.onclose = () => {
+    console.warn('WS closed; retrying in 2s');
+    setTimeout(() => connectFleet(onMessage), 2000);
+  };
+  ws.onerror = (err) => console.error('WS error', err);
+  return ws;
+}
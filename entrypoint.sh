@@ -3,6 +3,8 @@ set -e
 
 python manage.py collectstatic --noinput
 python manage.py migrate --noinput
+# Colección time-series e índices de Mongo (idempotente; no frena el arranque)
+python manage.py mongo_setup || echo "[init] mongo_setup falló; se reintenta en el próximo arranque"
 
 # Ensure default admin user exists
 python - <<'PY'
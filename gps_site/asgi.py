@@ -1,4 +1,5 @@
 import os
+from asgiref.sync import sync_to_async
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
@@ -9,8 +10,24 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gps_site.settings')
 
 django_asgi_app = get_asgi_application()
 
+
+async def lifespan(scope, receive, send):
+    # servidores con lifespan (uvicorn): vaciar la escritura diferida al apagar.
+    # daphne no lo implementa; ahí el reactor para limpio con SIGTERM y corre atexit.
+    from gpsapp.ingest import stop_writers
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await sync_to_async(stop_writers, thread_sensitive=False)()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
+    "lifespan": lifespan,
     "websocket": AuthMiddlewareStack(
         URLRouter(gpsapp.routing.websocket_urlpatterns)
     ),
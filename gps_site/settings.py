@@ -55,9 +55,14 @@ INSTALLED_APPS = [
     'gpsapp',
 ]
 
+# WhiteNoise es un middleware sólo-sync: bajo daphne obliga a pasar cada
+# request por un hilo aunque la vista sea async. Detrás de nginx (que ya sirve
+# /static/) conviene apagarlo con WHITENOISE_MIDDLEWARE=0.
+WHITENOISE_MIDDLEWARE = os.getenv('WHITENOISE_MIDDLEWARE', '1') == '1'
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    *(['whitenoise.middleware.WhiteNoiseMiddleware'] if WHITENOISE_MIDDLEWARE else []),
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -103,10 +108,27 @@ TEMPLATES = [
 WSGI_APPLICATION = 'gps_site.wsgi.application'
 ASGI_APPLICATION = 'gps_site.asgi.application'
 
+# SQLite afinado para escritura concurrente: WAL para que las lecturas de
+# historial no bloqueen la ingesta, synchronous=NORMAL (seguro con WAL) y
+# transacciones IMMEDIATE para no fallar al promover un lock de lectura.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', '-32000')),  # negativo = KiB
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'temp_store': 'MEMORY',
+}
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '5'))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.getenv('SQLITE_DB_PATH', str(BASE_DIR / 'gps_monitoring.db')),
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(f'PRAGMA {k}={v}' for k, v in SQLITE_PRAGMAS.items()),
+        },
     }
 }
 
@@ -139,18 +161,119 @@ DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
 # Channels (Redis) config via env, default to in-memory for dev
 REDIS_URL = os.getenv('REDIS_URL')
+# capacity/expiry acotan la cola de cada cliente: si uno se atrasa, los frames
+# viejos se descartan (el broadcaster manda un keyframe cada BROADCAST_KEYFRAME_S)
+CHANNEL_CAPACITY = int(os.getenv('CHANNEL_CAPACITY', '100'))
+CHANNEL_EXPIRY = int(os.getenv('CHANNEL_EXPIRY', '10'))
 if REDIS_URL:
     CHANNEL_LAYERS = {
         'default': {
             'BACKEND': 'channels_redis.core.RedisChannelLayer',
-            'CONFIG': {'hosts': [REDIS_URL]},
+            'CONFIG': {'hosts': [REDIS_URL], 'capacity': CHANNEL_CAPACITY, 'expiry': CHANNEL_EXPIRY},
         }
     }
 else:
     CHANNEL_LAYERS = {
         'default': {
-            'BACKEND': 'channels.layers.InMemoryChannelLayer'
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {'capacity': CHANNEL_CAPACITY, 'expiry': CHANNEL_EXPIRY},
+        }
+    }
+# Broadcast en vivo: posiciones coalescidas por vehículo cada BROADCAST_TICK_MS
+# (0 = una por fix), sólo campos cambiados salvo un keyframe cada BROADCAST_KEYFRAME_S
+BROADCAST_TICK_MS = int(os.getenv('BROADCAST_TICK_MS', '250'))
+BROADCAST_KEYFRAME_S = int(os.getenv('BROADCAST_KEYFRAME_S', '30'))
+# Estado en vivo (gpsapp.live) en hashes de Redis si hay REDIS_URL; expira si el vehículo no reporta
+LIVE_STATE_TTL = int(os.getenv('LIVE_STATE_TTL', str(7 * 86400)))
+
+# Caché (lecturas de historial): Redis si hay REDIS_URL (acotar con maxmemory
+# + allkeys-lru en Redis), si no memoria local acotada por cantidad de entradas
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'gps',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '2000'))},
         }
     }
 
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://mongodb:27017/gps_monitoring')
+# Pool y timeouts del cliente (ms); MONGO_WRITE_CONCERN acepta un número o 'majority'
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '10000'))
+MONGO_WRITE_CONCERN = os.getenv('MONGO_WRITE_CONCERN', '1')
+
+# Ingesta: máximo de posiciones aceptadas por POST en /api/update_location/batch
+INGEST_BATCH_MAX_FIXES = int(os.getenv('INGEST_BATCH_MAX_FIXES', '500'))
+
+# Escritura diferida de historial: la vista encola y un hilo de fondo escribe
+# por lotes (hasta INGEST_FLUSH_MAX_FIXES posiciones o INGEST_FLUSH_INTERVAL s).
+# Con la cola llena la API responde 429.
+INGEST_WRITE_BEHIND = os.getenv('INGEST_WRITE_BEHIND', '1') == '1'
+INGEST_QUEUE_MAXSIZE = int(os.getenv('INGEST_QUEUE_MAXSIZE', '10000'))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', '1.0'))
+INGEST_FLUSH_MAX_FIXES = int(os.getenv('INGEST_FLUSH_MAX_FIXES', '500'))
+
+# Cache en memoria device_id -> vehículo usada por la ingesta (segundos)
+DEVICE_REGISTRY_TTL = float(os.getenv('DEVICE_REGISTRY_TTL', '60'))
+
+# Listener TCP/UDP para equipos (python manage.py gps_listener); puerto 0 lo desactiva
+GPS_LISTENER_HOST = os.getenv('GPS_LISTENER_HOST', '0.0.0.0')
+GPS_LISTENER_TCP_PORT = int(os.getenv('GPS_LISTENER_TCP_PORT', '5055'))
+GPS_LISTENER_UDP_PORT = int(os.getenv('GPS_LISTENER_UDP_PORT', '5056'))
+# segundos sin recibir nada antes de cerrar una conexión TCP de equipo
+GPS_LISTENER_IDLE_TIMEOUT = int(os.getenv('GPS_LISTENER_IDLE_TIMEOUT', '300'))
+
+# Raleo en la ingesta: no guardar en historial puntos de un vehículo detenido
+# (a menos de INGEST_THIN_DISTANCE_M, misma ignición y velocidad), salvo una
+# fila de latido cada INGEST_THIN_HEARTBEAT segundos.
+INGEST_THIN_ENABLED = os.getenv('INGEST_THIN_ENABLED', '1') == '1'
+INGEST_THIN_DISTANCE_M = float(os.getenv('INGEST_THIN_DISTANCE_M', '15'))
+INGEST_THIN_SPEED_DELTA = float(os.getenv('INGEST_THIN_SPEED_DELTA', '2'))
+INGEST_THIN_HEARTBEAT = int(os.getenv('INGEST_THIN_HEARTBEAT', '300'))
+
+# Retención y agregados de historial (python manage.py history_rollup)
+HISTORY_RAW_RETENTION_DAYS = int(os.getenv('HISTORY_RAW_RETENTION_DAYS', '30'))
+HISTORY_MINUTE_RETENTION_DAYS = int(os.getenv('HISTORY_MINUTE_RETENTION_DAYS', '180'))
+HISTORY_ROLLUP_MAX_GAP = int(os.getenv('HISTORY_ROLLUP_MAX_GAP', '600'))
+# resolution=auto en la API: crudo hasta 48 h, minuto hasta 14 días, después hora
+HISTORY_RAW_MAX_SPAN_HOURS = int(os.getenv('HISTORY_RAW_MAX_SPAN_HOURS', '48'))
+HISTORY_MINUTE_MAX_SPAN_DAYS = int(os.getenv('HISTORY_MINUTE_MAX_SPAN_DAYS', '14'))
+# tope de limit= en la paginación de la API de historial
+HISTORY_PAGE_MAX = int(os.getenv('HISTORY_PAGE_MAX', '20000'))
+# rango máximo (horas) de /api/fleet/history, que trae la flota entera en crudo
+HISTORY_FLEET_MAX_SPAN_HOURS = int(os.getenv('HISTORY_FLEET_MAX_SPAN_HOURS', '24'))
+# lado (grados) de la celda base del mapa de densidad; ~110 m en latitud
+HEATMAP_CELL_DEG = float(os.getenv('HEATMAP_CELL_DEG', '0.001'))
+# topes de /api/fleet/heatmap: celdas devueltas (16 px c/u) y días sumados
+HEATMAP_MAX_CELLS = int(os.getenv('HEATMAP_MAX_CELLS', '100000'))
+HEATMAP_MAX_DAYS = int(os.getenv('HEATMAP_MAX_DAYS', '366'))
+# Caché de historial crudo por baldes de HISTORY_CACHE_BUCKET segundos; el balde
+# que contiene "ahora" vive HISTORY_CACHE_OPEN_TTL (otros procesos, como el
+# listener, pueden escribir sin invalidar una caché en memoria local)
+HISTORY_CACHE_ENABLED = os.getenv('HISTORY_CACHE_ENABLED', '1') == '1'
+HISTORY_CACHE_BUCKET = int(os.getenv('HISTORY_CACHE_BUCKET', '3600'))
+HISTORY_CACHE_TTL = int(os.getenv('HISTORY_CACHE_TTL', '86400'))
+HISTORY_CACHE_OPEN_TTL = int(os.getenv('HISTORY_CACHE_OPEN_TTL', '30'))
+HISTORY_CACHE_MAX_SPAN_DAYS = int(os.getenv('HISTORY_CACHE_MAX_SPAN_DAYS', '8'))
+# baldes con más filas que esto se leen directo, sin guardarse
+HISTORY_CACHE_MAX_BUCKET_ROWS = int(os.getenv('HISTORY_CACHE_MAX_BUCKET_ROWS', '20000'))
+
+# Backend de historial: el primario (sqlite, mongo o file) se escribe en la
+# transacción de ingesta; los espejos reciben el lote por su propia cola.
+HISTORY_STORE = os.getenv('HISTORY_STORE', 'sqlite')
+HISTORY_MIRRORS = _split_csv(os.getenv('HISTORY_MIRRORS', 'mongo'))
+HISTORY_FILE_DIR = os.getenv('HISTORY_FILE_DIR', str(BASE_DIR / 'history_data'))
+# Archivo columnar (.npy por día): los días UTC completos más viejos que
+# HISTORY_ARCHIVE_AFTER_DAYS salen del store primario (0 = desactivado)
+HISTORY_ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', str(BASE_DIR / 'history_archive'))
+HISTORY_ARCHIVE_AFTER_DAYS = int(os.getenv('HISTORY_ARCHIVE_AFTER_DAYS', '3'))
@@ -5,3 +5,13 @@ class GpsAppConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'gpsapp'
 
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+        from . import broadcaster, live, registry, thinning
+        from .models import Vehicle
+        post_save.connect(registry.on_vehicle_changed, sender=Vehicle, dispatch_uid='registry_vehicle_saved')
+        post_delete.connect(registry.on_vehicle_changed, sender=Vehicle, dispatch_uid='registry_vehicle_deleted')
+        post_save.connect(live.on_vehicle_saved, sender=Vehicle, dispatch_uid='live_vehicle_saved')
+        post_delete.connect(live.on_vehicle_deleted, sender=Vehicle, dispatch_uid='live_vehicle_deleted')
+        post_delete.connect(thinning.on_vehicle_deleted, sender=Vehicle, dispatch_uid='thinning_vehicle_deleted')
+        post_delete.connect(broadcaster.on_vehicle_deleted, sender=Vehicle, dispatch_uid='broadcaster_vehicle_deleted')
@@ -0,0 +1,233 @@
+"""Archivo frío del historial: un directorio por vehículo y día UTC con una
+columna ``.npy`` por campo.
+
+    <HISTORY_ARCHIVE_DIR>/<vehicle_id>/<YYYY-MM-DD>/
+        ts.npy     int64    epoch en microsegundos, ordenado
+        lat.npy    int32    grados * 1e7
+        lng.npy    int32    grados * 1e7
+        speed.npy  float32  km/h
+        sq.npy     uint8    CSQ
+        flags.npy  uint8    bit0 = encendido
+
+Las columnas se abren con ``mmap_mode='r'`` y se recortan por tiempo con
+búsqueda binaria sobre ``ts``: leer un rango viejo no toca la base ni copia
+más que el tramo pedido. ``query_range`` junta archivo y store primario, así
+la API y los rollups no necesitan saber en qué capa está cada día.
+"""
+import logging
+import os
+import shutil
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .stores import get_store, mirror_names
+
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = {
+    'ts': np.int64,
+    'lat': np.int32,
+    'lng': np.int32,
+    'speed': np.float32,
+    'sq': np.uint8,
+    'flags': np.uint8,
+}
+FLAG_VEHICLE_ON = 0x01
+# vueltas de archivo por corrida: cada una toma lo que llegó durante la anterior
+ARCHIVE_PASSES = 3
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _root() -> Path:
+    return Path(getattr(settings, 'HISTORY_ARCHIVE_DIR', 'history_archive'))
+
+
+def _day_dir(vehicle_id: int, day) -> Path:
+    return _root() / str(vehicle_id) / day.isoformat()
+
+
+def _day_bounds(day):
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def _utc_day(dt: datetime):
+    return dt.astimezone(dt_timezone.utc).date()
+
+
+def _us(dt: datetime) -> int:
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def is_archived(vehicle_id: int, day) -> bool:
+    return (_day_dir(vehicle_id, day) / 'ts.npy').exists()
+
+
+def archived_days(vehicle_id: int) -> list:
+    folder = _root() / str(vehicle_id)
+    if not folder.exists():
+        return []
+    days = []
+    for path in folder.iterdir():
+        try:
+            day = datetime.strptime(path.name, '%Y-%m-%d').date()
+        except ValueError:
+            continue
+        if (path / 'ts.npy').exists():
+            days.append(day)
+    return sorted(days)
+
+
+def load_day(vehicle_id: int, day) -> dict:
+    """Columnas del día mapeadas en memoria (vacío si no está archivado)."""
+    folder = _day_dir(vehicle_id, day)
+    if not (folder / 'ts.npy').exists():
+        return {}
+    return {name: np.load(folder / f'{name}.npy', mmap_mode='r') for name in COLUMNS}
+
+
+def slice_day(cols: dict, dt_from: datetime, dt_to: datetime) -> dict:
+    """Vista de las columnas con ``dt_from <= ts <= dt_to``."""
+    if not cols:
+        return {}
+    ts = cols['ts']
+    lo = np.searchsorted(ts, _us(dt_from), side='left')
+    hi = np.searchsorted(ts, _us(dt_to), side='right')
+    return {name: col[lo:hi] for name, col in cols.items()}
+
+
+def _rows(cols: dict):
+    if not cols or not len(cols['ts']):
+        return
+    # tolist() convierte cada columna de una vez, más barato que indexar fila a fila
+    ts = cols['ts'].tolist()
+    lat = (cols['lat'] / 1e7).tolist()
+    lng = (cols['lng'] / 1e7).tolist()
+    speed = cols['speed'].tolist()
+    sq = cols['sq'].tolist()
+    on = (cols['flags'] & FLAG_VEHICLE_ON).astype(bool).tolist()
+    for i, us in enumerate(ts):
+        yield (EPOCH + timedelta(microseconds=us), lat[i], lng[i], speed[i], sq[i], on[i])
+
+
+def write_day(vehicle_id: int, day, rows: list) -> int:
+    """Escribe (o reescribe) el día con ``rows`` en formato ``stores.FIELDS``.
+
+    Se escribe en un directorio temporal y se renombra, así un lector nunca ve
+    columnas a medio escribir.
+    """
+    rows = sorted(rows, key=lambda r: r[0])
+    cols = {
+        'ts': np.fromiter((_us(r[0]) for r in rows), COLUMNS['ts'], len(rows)),
+        'lat': np.fromiter((round(r[1] * 1e7) for r in rows), COLUMNS['lat'], len(rows)),
+        'lng': np.fromiter((round(r[2] * 1e7) for r in rows), COLUMNS['lng'], len(rows)),
+        'speed': np.fromiter((r[3] for r in rows), COLUMNS['speed'], len(rows)),
+        'sq': np.fromiter((min(max(int(r[4]), 0), 255) for r in rows), COLUMNS['sq'], len(rows)),
+        'flags': np.fromiter((FLAG_VEHICLE_ON if r[5] else 0 for r in rows), COLUMNS['flags'], len(rows)),
+    }
+    final = _day_dir(vehicle_id, day)
+    tmp = final.with_name(final.name + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name, col in cols.items():
+        np.save(tmp / f'{name}.npy', col)
+    old = final.with_name(final.name + '.old')
+    if final.exists():
+        os.replace(final, old)
+    os.replace(tmp, final)
+    shutil.rmtree(old, ignore_errors=True)
+    return len(rows)
+
+
+def archive_vehicle(vehicle_id: int, cutoff: datetime) -> dict:
+    """Pasa al archivo los días UTC completos anteriores a ``cutoff`` que
+    todavía tienen filas en el store primario y después borra de ahí y de los
+    espejos exactamente las filas archivadas.
+
+    Las filas que llegan tarde para un día ya archivado se mezclan con lo que
+    ya estaba en el archivo. Una que entra mientras se archiva no se borra:
+    queda en el store y la toma la vuelta siguiente (hasta
+    ``ARCHIVE_PASSES``; si no, la próxima corrida).
+    """
+    store = get_store()
+    mirrors = [get_store(n) for n in mirror_names()]
+    cutoff = _day_bounds(_utc_day(cutoff))[0]
+    done = {}
+    for _ in range(ARCHIVE_PASSES):
+        pending = {}
+        for row in store.query_range(vehicle_id, EPOCH, cutoff - timedelta(microseconds=1)):
+            pending.setdefault(_utc_day(row[0]), []).append(row)
+        if not pending:
+            break
+        stamps = [r[0] for rows in pending.values() for r in rows]
+        for day, rows in sorted(pending.items()):
+            if is_archived(vehicle_id, day):
+                seen = {_us(r[0]) for r in rows}
+                rows += [r for r in _rows(load_day(vehicle_id, day)) if _us(r[0]) not in seen]
+            done[day.isoformat()] = write_day(vehicle_id, day, rows)
+        store.delete_at(vehicle_id, stamps)
+        for mirror in mirrors:
+            try:
+                mirror.delete_at(vehicle_id, stamps)
+            except Exception:
+                logger.warning('No se pudo borrar lo archivado en %s', mirror.name)
+    if done:
+        # import local: history_cache importa este módulo
+        from . import history_cache
+        history_cache.invalidate_vehicle(vehicle_id)
+    return done
+
+
+def delete_before(vehicle_id: int, cutoff: datetime) -> int:
+    """Borra los días archivados completos anteriores a ``cutoff``."""
+    cutoff_day = _utc_day(cutoff)
+    removed = 0
+    for day in archived_days(vehicle_id):
+        if day < cutoff_day:
+            shutil.rmtree(_day_dir(vehicle_id, day), ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def query_range(vehicle_id: int, dt_from: datetime, dt_to: datetime, store=None):
+    """Igual que ``HistoryStore.query_range`` pero los días archivados salen
+    del archivo; los tramos contiguos sin archivar van en una sola consulta."""
+    store = store or get_store()
+    archived = set(archived_days(vehicle_id))
+    day, last_day = _utc_day(dt_from), _utc_day(dt_to)
+    pending_from = None
+    while day <= last_day:
+        start, end = _day_bounds(day)
+        lo, hi = max(dt_from, start), min(dt_to, end - timedelta(microseconds=1))
+        if day in archived:
+            if pending_from is not None:
+                yield from store.query_range(vehicle_id, pending_from, lo - timedelta(microseconds=1))
+                pending_from = None
+            yield from _rows(slice_day(load_day(vehicle_id, day), lo, hi))
+        elif pending_from is None:
+            pending_from = lo
+        day += timedelta(days=1)
+    if pending_from is not None:
+        yield from store.query_range(vehicle_id, pending_from, dt_to)
+
+
+def query_many(vehicle_ids, dt_from: datetime, dt_to: datetime, store=None):
+    """``store.query_many`` para los vehículos sin días archivados en el rango
+    (una sola consulta); los demás van por ``query_range`` de a uno."""
+    store = store or get_store()
+    first_day, last_day = _utc_day(dt_from), _utc_day(dt_to)
+    plain, tiered = [], []
+    for vid in sorted(vehicle_ids):
+        if any(first_day <= day <= last_day for day in archived_days(vid)):
+            tiered.append(vid)
+        else:
+            plain.append(vid)
+    if plain:
+        yield from store.query_many(plain, dt_from, dt_to)
+    for vid in tiered:
+        for row in query_range(vid, dt_from, dt_to, store):
+            yield (vid,) + row
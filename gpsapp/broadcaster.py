@@ -0,0 +1,154 @@
+"""Broadcast coalescido de posiciones en vivo.
+
+Las posiciones se juntan por vehículo durante ``BROADCAST_TICK_MS``: si llega
+otra antes del tick, la anterior se descarta. En cada tick se manda sólo lo
+que cambió respecto del último envío (``vehicle_id`` va siempre; ``lat`` y
+``lng`` van juntas si cambia cualquiera de las dos) a
+``vehicle_<id>`` y, agrupado en un solo frame ``{"vehicles": [...]}`` por
+dueño, a ``fleet_<user_id>``. Cada ``BROADCAST_KEYFRAME_S`` se manda el
+estado completo, así un cliente que perdió frames (capacidad/expiración del
+channel layer) o que recibe de varios procesos se resincroniza. Pasado ese
+intervalo el último estado enviado ya no hace falta y se descarta, igual
+que al borrar el vehículo.
+
+Los comandos (``shutdown``/``transmit_audio``) no esperan el tick: el
+listener los reenvía al equipo. Una posición con ``fix_ts`` más viejo que la
+encolada o la última enviada se descarta (ver ``gpsapp.live``).
+"""
+import asyncio
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import frames, live
+
+logger = logging.getLogger(__name__)
+
+# campos que el cliente necesita juntos: una posición no se parte en dos frames
+POSITION = ('lat', 'lng')
+
+
+class Broadcaster:
+    def __init__(self, tick: float, keyframe: float):
+        self.tick = tick
+        self.keyframe = keyframe
+        self.pending = {}  # vehicle_id -> (user_id, payload)
+        self.sent = {}     # vehicle_id -> (último estado enviado, hora del último completo)
+        self.task = None
+        self.pruned_at = time.monotonic()
+        self.counters = {'published': 0, 'superseded': 0, 'unchanged': 0, 'stale': 0, 'frames': 0, 'errors': 0}
+
+    async def publish(self, vehicle_id: int, payload: dict, user_id: int = None):
+        self.counters['published'] += 1
+        prev = self.pending.get(vehicle_id)
+        if (live.is_older(payload, prev[1] if prev is not None else {})
+                or live.is_older(payload, self.sent.get(vehicle_id, ({}, None))[0])):
+            self.counters['stale'] += 1
+            return
+        if self.tick <= 0 or 'command' in payload:
+            if prev is not None:
+                # la posición encolada trae los flags de antes del comando
+                state = {k: v for k, v in payload.items() if k != 'command'}
+                self.pending[vehicle_id] = (prev[0], {**prev[1], **state})
+            await self._send({vehicle_id: (user_id, payload)})
+            return
+        if prev is not None:
+            self.counters['superseded'] += 1
+            payload = {**prev[1], **payload}
+        self.pending[vehicle_id] = (user_id, payload)
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self._run())
+
+    async def _run(self):
+        while self.pending:
+            await asyncio.sleep(self.tick)
+            pending, self.pending = self.pending, {}
+            await self._send(pending)
+
+    def _delta(self, vehicle_id, payload):
+        now = time.monotonic()
+        last, keyed_at = self.sent.get(vehicle_id, ({}, None))
+        full = keyed_at is None or now - keyed_at >= self.keyframe
+        if full:
+            data = dict(payload)
+        else:
+            data = {k: v for k, v in payload.items() if k == 'command' or k not in last or last[k] != v}
+            if any(k in data for k in POSITION):
+                data.update({k: payload[k] for k in POSITION if k in payload})
+            if not data:
+                self.counters['unchanged'] += 1
+                return None
+            data['vehicle_id'] = payload['vehicle_id']
+        self.sent[vehicle_id] = ({**last, **payload}, now if full else keyed_at)
+        return data
+
+    def forget(self, vehicle_id: int):
+        self.pending.pop(vehicle_id, None)
+        self.sent.pop(vehicle_id, None)
+
+    def _prune(self, now: float):
+        # con el keyframe vencido el próximo envío es completo: no se compara con nada
+        self.pruned_at = now
+        for vehicle_id, (_, keyed_at) in list(self.sent.items()):
+            if now - keyed_at >= self.keyframe:
+                self.sent.pop(vehicle_id, None)
+
+    async def _send(self, pending: dict):
+        channel_layer = get_channel_layer()
+        now = time.monotonic()
+        if now - self.pruned_at >= self.keyframe:
+            self._prune(now)
+        deltas, fleets = {}, {}
+        for vehicle_id, (user_id, payload) in pending.items():
+            data = self._delta(vehicle_id, payload)
+            if data is None:
+                continue
+            deltas[vehicle_id] = data
+            if user_id is not None:
+                fleets.setdefault(user_id, []).append(data)
+        if not deltas:
+            return
+        # MessagePack sólo para los grupos que tienen quién lo reciba
+        binary = await frames.abinary_groups(
+            [f"vehicle_{vid}" for vid in deltas] + [f"fleet_{uid}" for uid in fleets])
+        for vehicle_id, data in deltas.items():
+            group = f"vehicle_{vehicle_id}"
+            try:
+                await channel_layer.group_send(group, frames.event("vehicle.event", data, group in binary))
+                self.counters['frames'] += 1
+            except Exception:
+                self.counters['errors'] += 1
+                logger.warning('No se pudo publicar el vehículo %s', vehicle_id)
+        for user_id, items in fleets.items():
+            group = f"fleet_{user_id}"
+            try:
+                await channel_layer.group_send(group, frames.event("fleet.event", {'vehicles': items}, group in binary))
+                self.counters['frames'] += 1
+            except Exception:
+                self.counters['errors'] += 1
+                logger.warning('No se pudo publicar la flota del usuario %s', user_id)
+
+    def snapshot(self) -> dict:
+        return dict(self.counters, pending=len(self.pending), tracked=len(self.sent),
+                    tick_ms=int(self.tick * 1000))
+
+
+_broadcaster = None
+
+
+def get_broadcaster() -> Broadcaster:
+    global _broadcaster
+    if _broadcaster is None:
+        _broadcaster = Broadcaster(
+            tick=getattr(settings, 'BROADCAST_TICK_MS', 250) / 1000,
+            keyframe=getattr(settings, 'BROADCAST_KEYFRAME_S', 30),
+        )
+    return _broadcaster
+
+
+def on_vehicle_deleted(sender, instance, **kwargs):
+    if _broadcaster is not None:
+        _broadcaster.forget(instance.id)
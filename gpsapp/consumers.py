@@ -1,22 +1,72 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from . import frames, live
+from .models import Vehicle
+
 
 class VehicleConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.vehicle_id = self.scope['url_route']['kwargs']['vehicle_id']
+        # sólo el dueño, igual que vehicle_map: el snapshot trae la posición actual
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated or not await Vehicle.objects.filter(
+                id=self.vehicle_id, user_id=user.id).aexists():
+            await self.close()
+            return
         self.group_name = f"vehicle_{self.vehicle_id}"
+        self.format, subprotocol = frames.negotiate(self.scope)
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        if self.format == 'msgpack':
+            await frames.amark_binary(self.group_name)
+        await self.accept(subprotocol)
+        # snapshot inmediato: sin esto la página espera al próximo fix
+        state = (await live.aget_many([int(self.vehicle_id)])).get(int(self.vehicle_id))
+        if state:
+            await self.send(**frames.encode(self.format, {'vehicle_id': str(self.vehicle_id), **state}))
 
     async def disconnect(self, code):
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def receive(self, text_data=None, bytes_data=None):
         # Client-to-server not used currently
         pass
 
     async def vehicle_event(self, event):
-        data = event.get('data', {})
-        await self.send(text_data=json.dumps(data))
+        # ya viene codificado por el broadcaster: nada de json.dumps por cliente
+        if self.format == 'msgpack' and 'binary' not in event:
+            await frames.amark_binary(self.group_name)
+        await self.send(**frames.from_event(self.format, event))
+
+
+class FleetConsumer(AsyncWebsocketConsumer):
+    """Un socket por pestaña con todos los vehículos del usuario logueado:
+    el broadcaster publica en ``fleet_<user_id>`` frames ``{"vehicles": [...]}``."""
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = f"fleet_{user.id}"
+        self.format, subprotocol = frames.negotiate(self.scope)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        if self.format == 'msgpack':
+            await frames.amark_binary(self.group_name)
+        await self.accept(subprotocol)
+        ids = [vid async for vid in Vehicle.objects.filter(user_id=user.id).values_list('id', flat=True)]
+        state = await live.aget_many(ids)
+        if state:
+            await self.send(**frames.encode(
+                self.format, {'vehicles': [{'vehicle_id': str(vid), **fields} for vid, fields in state.items()]}))
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        pass
 
+    async def fleet_event(self, event):
+        if self.format == 'msgpack' and 'binary' not in event:
+            await frames.amark_binary(self.group_name)
+        await self.send(**frames.from_event(self.format, event))
@@ -0,0 +1,88 @@
+"""Formatos compactos de respuesta para el historial.
+
+``columnar``: un array por campo; los timestamps van como epoch en segundos
+con delta respecto del anterior (el primero es absoluto).
+
+``polyline``: coordenadas en Google encoded polyline (precisión 5 por
+defecto, ~1 m) y los demás campos como enteros con delta.
+
+Todo se arma por columnas NumPy, sin un dict por punto.
+"""
+import numpy as np
+
+
+def columns(rows):
+    """Filas ``stores.FIELDS`` -> arrays ``(ts, lat, lng, speed, sq, on)``;
+    ``ts`` en epoch segundos (float)."""
+    cols = list(zip(*rows))
+    if not cols:
+        return (np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0),
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool))
+    ts, lat, lng, speed, sq, on = cols
+    return (
+        np.fromiter((t.timestamp() for t in ts), float, len(ts)),
+        np.array(lat, dtype=float),
+        np.array(lng, dtype=float),
+        np.array(speed, dtype=float),
+        np.array(sq, dtype=np.int64),
+        np.array(on, dtype=bool),
+    )
+
+
+def delta(values) -> list:
+    """Enteros con delta: ``[v0, v1 - v0, v2 - v1, ...]``."""
+    values = np.asarray(values, dtype=np.int64)
+    if not len(values):
+        return []
+    return np.diff(values, prepend=0).tolist()
+
+
+def encode_polyline(lat, lng, precision: int = 5) -> str:
+    """Google encoded polyline, vectorizado: cada delta (zigzag) se parte en
+    grupos de 5 bits y se arman todos los caracteres de una vez."""
+    factor = 10 ** precision
+    pts = np.empty(len(lat) * 2, dtype=np.int64)
+    pts[0::2] = np.round(np.asarray(lat) * factor)
+    pts[1::2] = np.round(np.asarray(lng) * factor)
+    if not len(pts):
+        return ''
+    d = np.empty_like(pts)
+    d[:2] = pts[:2]
+    d[2:] = pts[2:] - pts[:-2]
+    z = np.where(d < 0, ~(d << 1), d << 1)
+    # a lo sumo 7 grupos de 5 bits por valor (coordenadas * 1e7 entran en 35 bits)
+    shifts = np.arange(7) * 5
+    groups = (z[:, None] >> shifts) & 0x1F
+    ngroups = 1 + ((z[:, None] >> shifts[1:]) > 0).sum(axis=1)
+    used = np.arange(7) < ngroups[:, None]
+    more = np.arange(7) < (ngroups[:, None] - 1)
+    chars = (groups | np.where(more, 0x20, 0)) + 63
+    return chars[used].astype(np.uint8).tobytes().decode('ascii')
+
+
+def columnar(rows) -> dict:
+    ts, lat, lng, speed, sq, on = columns(rows)
+    return {
+        'format': 'columnar',
+        'count': len(ts),
+        'timestamp': delta(np.floor(ts)),
+        'lat': np.round(lat, 6).tolist(),
+        'lng': np.round(lng, 6).tolist(),
+        'speed': np.round(speed, 1).tolist(),
+        'signal_quality': sq.tolist(),
+        'vehicle_on': on.astype(np.int8).tolist(),
+    }
+
+
+def polyline(rows, precision: int = 5) -> dict:
+    ts, lat, lng, speed, sq, on = columns(rows)
+    return {
+        'format': 'polyline',
+        'count': len(ts),
+        'precision': precision,
+        'polyline': encode_polyline(lat, lng, precision),
+        'timestamp': delta(np.floor(ts)),
+        'speed': delta(np.round(speed)),
+        'signal_quality': delta(sq),
+        'vehicle_on': delta(on),
+    }
@@ -0,0 +1,85 @@
+"""Codificación de los frames WebSocket en vivo.
+
+El cliente elige el formato con el subprotocolo (``msgpack`` o ``json``) o
+con ``?format=msgpack``; por defecto, JSON en frames de texto. El
+broadcaster codifica cada evento una sola vez (``event()``) y cada consumer
+manda los bytes ya armados, así el costo no crece con la cantidad de
+suscriptores.
+
+El mensaje lleva siempre ``text`` y, sólo si el grupo tiene suscriptores
+MessagePack, ``binary``. Esos consumers lo avisan con una marca en la caché
+(``frames:msgpack:<grupo>``, ``BINARY_MARK_TTL``) que renuevan cada vez que
+les llega un evento sin ``binary``; mientras tanto codifican ellos desde
+``text``. Los comandos llevan además ``command`` y ``vehicle_id`` sueltos
+para el listener.
+"""
+import json
+import logging
+from urllib.parse import parse_qs
+
+import msgpack
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('msgpack', 'json')
+BINARY_MARK_TTL = 60
+
+
+def _mark_key(group: str) -> str:
+    return f'frames:msgpack:{group}'
+
+
+def event(type_: str, data: dict, binary: bool = False) -> dict:
+    """Mensaje de channel layer con ``data`` codificado (``binary`` sólo si
+    se pide)."""
+    message = {'type': type_, 'text': json.dumps(data)}
+    if binary:
+        message['binary'] = msgpack.packb(data)
+    if 'command' in data:
+        message['command'] = data['command']
+        message['vehicle_id'] = data.get('vehicle_id')
+    return message
+
+
+async def amark_binary(group: str):
+    """Avisa que ``group`` tiene un suscriptor MessagePack."""
+    try:
+        await cache.aset(_mark_key(group), 1, BINARY_MARK_TTL)
+    except Exception:
+        logger.warning('No se pudo marcar el grupo %s como msgpack', group)
+
+
+async def abinary_groups(groups) -> set:
+    """Los grupos de ``groups`` con suscriptores MessagePack."""
+    keys = {_mark_key(group): group for group in groups}
+    try:
+        found = await cache.aget_many(list(keys))
+    except Exception:
+        # sin la marca los consumers codifican desde ``text``
+        return set()
+    return {keys[key] for key in found}
+
+
+def negotiate(scope) -> tuple:
+    """``(formato, subprotocolo a aceptar o None)``."""
+    for proto in scope.get('subprotocols') or ():
+        if proto in FORMATS:
+            return proto, proto
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    if query.get('format', [''])[0] == 'msgpack':
+        return 'msgpack', None
+    return 'json', None
+
+
+def encode(fmt: str, data: dict) -> dict:
+    """kwargs de ``send()`` para un frame que no viene pre-codificado (snapshots)."""
+    if fmt == 'msgpack':
+        return {'bytes_data': msgpack.packb(data)}
+    return {'text_data': json.dumps(data)}
+
+
+def from_event(fmt: str, ev: dict) -> dict:
+    if fmt == 'msgpack':
+        return {'bytes_data': ev['binary']} if 'binary' in ev else encode(fmt, json.loads(ev['text']))
+    return {'text_data': ev['text']}
@@ -0,0 +1,23 @@
+from math import radians, sin, cos, asin, sqrt
+
+import numpy as np
+
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat1, lng1, lat2, lng2) -> float:
+    p1, p2 = radians(lat1), radians(lat2)
+    dlat = p2 - p1
+    dlng = radians(lng2 - lng1)
+    a = sin(dlat / 2) ** 2 + cos(p1) * cos(p2) * sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * asin(sqrt(a))
+
+
+def segment_distances_m(lat, lng):
+    """Distancia de cada tramo consecutivo (arrays NumPy en grados)."""
+    p = np.radians(lat)
+    dlat = np.diff(p)
+    dlng = np.radians(np.diff(lng))
+    a = np.sin(dlat / 2) ** 2 + np.cos(p[:-1]) * np.cos(p[1:]) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
@@ -0,0 +1,124 @@
+"""Mapa de densidad: celdas de grilla por vehículo y día local.
+
+Cada fix cae en una celda de ``HEATMAP_CELL_DEG`` grados (lat/lng, alineada a
+-90/-180) y suma una muestra y su permanencia: el tiempo hasta el fix
+siguiente, con tope ``HISTORY_ROLLUP_MAX_GAP``. El binning se hace una vez,
+en ``history_rollup``, con NumPy; la API sólo suma celdas ya agregadas y las
+agrupa en celdas más grandes según el zoom.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from . import archive
+from .models import HeatCell
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# píxeles de pantalla por celda devuelta (tiles de 256 px)
+CELL_PX = 16
+
+
+def cell_deg() -> float:
+    return getattr(settings, 'HEATMAP_CELL_DEG', 0.001)
+
+
+def cell_index(lat, lng):
+    size = cell_deg()
+    return (np.floor((np.asarray(lng, dtype=float) + 180) / size).astype(np.int64),
+            np.floor((np.asarray(lat, dtype=float) + 90) / size).astype(np.int64))
+
+
+def bin_rows(rows, max_gap: float) -> dict:
+    """Filas ``stores.FIELDS`` -> ``{día local: (ix, iy, muestras, segundos)}``."""
+    cols = list(zip(*rows))
+    if not cols:
+        return {}
+    ts, lat, lng = cols[0], cols[1], cols[2]
+    secs = np.fromiter(((t - EPOCH).total_seconds() for t in ts), float, len(ts))
+    dwell = np.minimum(np.diff(secs, append=secs[-1]), max_gap)
+    ix, iy = cell_index(lat, lng)
+    days = np.array([timezone.localtime(t).date().toordinal() for t in ts], dtype=np.int64)
+    # una clave por (día, celda); np.unique ordena y agrupa de una vez
+    keys = np.stack([days, ix, iy], axis=1)
+    uniq, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    counts = np.bincount(inverse, minlength=len(uniq))
+    seconds = np.bincount(inverse, weights=dwell, minlength=len(uniq))
+    out = {}
+    for day in np.unique(uniq[:, 0]).tolist():
+        sel = uniq[:, 0] == day
+        out[datetime.fromordinal(day).date()] = (uniq[sel, 1], uniq[sel, 2], counts[sel], seconds[sel])
+    return out
+
+
+def run_vehicle(vehicle_id: int, now: datetime = None, dirty_from: datetime = None) -> dict:
+    """Rehace las celdas desde el último día agregado (incluido, puede estar
+    incompleto) hasta ``now``; con fixes tardíos, desde el día de ``dirty_from``."""
+    now = now or timezone.now()
+    last_day = HeatCell.objects.filter(vehicle_id=vehicle_id).aggregate(m=Max('day'))['m']
+    if dirty_from is not None and last_day is not None:
+        last_day = min(last_day, timezone.localtime(dirty_from).date())
+    tz = timezone.get_current_timezone()
+    since = datetime.combine(last_day, datetime.min.time(), tzinfo=tz) if last_day else EPOCH
+    binned = bin_rows(archive.query_range(vehicle_id, since, now),
+                      getattr(settings, 'HISTORY_ROLLUP_MAX_GAP', 600))
+    if not binned:
+        return {}
+    with transaction.atomic():
+        HeatCell.objects.filter(vehicle_id=vehicle_id, day__in=list(binned)).delete()
+        HeatCell.objects.bulk_create([
+            HeatCell(vehicle_id=vehicle_id, day=day, ix=x, iy=y, samples=n, dwell_s=s)
+            for day, (ix, iy, n, sec) in binned.items()
+            for x, y, n, s in zip(ix.tolist(), iy.tolist(), n.tolist(), sec.tolist())
+        ], batch_size=2000)
+    return {'heat_days': len(binned)}
+
+
+def zoom_factor(zoom: float) -> int:
+    """Cuántas celdas base por lado entran en una celda de ``CELL_PX`` píxeles."""
+    target = CELL_PX * 360 / (256 * 2 ** zoom)
+    return max(1, 2 ** int(np.floor(np.log2(max(target / cell_deg(), 1)))))
+
+
+def output_cells(bbox, zoom: float) -> int:
+    """Cuántas celdas (como máximo) devuelve ``query`` para ``bbox`` y ``zoom``."""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    (x0, x1), (y0, y1) = cell_index([min_lat, max_lat], [min_lng, max_lng])
+    factor = zoom_factor(zoom)
+    return int((x1 // factor - x0 // factor + 1) * (y1 // factor - y0 // factor + 1))
+
+
+def query(vehicle_ids, day_from, day_to, bbox, zoom: float) -> dict:
+    """Celdas agregadas (todos los vehículos y días sumados) dentro de
+    ``bbox = (min_lng, min_lat, max_lng, max_lat)``, en columnas."""
+    size = cell_deg()
+    min_lng, min_lat, max_lng, max_lat = bbox
+    (x0, x1), (y0, y1) = cell_index([min_lat, max_lat], [min_lng, max_lng])
+    factor = zoom_factor(zoom)
+    # se agrupa en la base (ix/iy >= 0: la división entera es el piso), así
+    # vuelve una fila por celda de salida y no todas las celdas base
+    rows = list(HeatCell.objects
+                .filter(vehicle_id__in=list(vehicle_ids), day__gte=day_from, day__lte=day_to,
+                        ix__gte=int(x0), ix__lte=int(x1), iy__gte=int(y0), iy__lte=int(y1))
+                .annotate(gx=F('ix') / factor, gy=F('iy') / factor)
+                .values('gx', 'gy')
+                .order_by()
+                .annotate(total_samples=Sum('samples'), total_dwell=Sum('dwell_s'))
+                .values_list('gx', 'gy', 'total_samples', 'total_dwell'))
+    out = {'cell_deg': size * factor, 'count': 0, 'lat': [], 'lng': [], 'samples': [], 'dwell_s': []}
+    if not rows:
+        return out
+    gx, gy, samples, dwell = (np.array(c) for c in zip(*rows))
+    half = size * factor / 2
+    out.update({
+        'count': len(rows),
+        'lat': np.round(gy * size * factor - 90 + half, 6).tolist(),
+        'lng': np.round(gx * size * factor - 180 + half, 6).tolist(),
+        'samples': samples.astype(np.int64).tolist(),
+        'dwell_s': np.round(dwell.astype(float), 1).tolist(),
+    })
+    return out
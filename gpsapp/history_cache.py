@@ -0,0 +1,208 @@
+"""Caché de lecturas de historial por baldes de tiempo.
+
+El rango pedido se parte en baldes de ``HISTORY_CACHE_BUCKET`` segundos
+alineados a epoch; cada balde se guarda entero (columnas NumPy) bajo
+``hist:<vehículo>:<store>:<inicio>`` y se recorta al rango al leer, así los
+rangos rápidos de la página (1h, hoy, 7d...) reusan los mismos baldes
+aunque el "desde" se mueva. Los baldes cerrados duran
+``HISTORY_CACHE_TTL``; el balde abierto (el que contiene "ahora") dura
+``HISTORY_CACHE_OPEN_TTL``.
+
+Cada balde se guarda con la versión que tenía al empezar a leerlo: invalidar
+cambia la versión (``hist:<vehículo>:<store>:<inicio>:v``, o la general del
+vehículo ``hist:<vehículo>:gen``) y un balde con versión vieja cuenta como
+faltante, aunque un llenado concurrente lo haya escrito después. La ingesta
+invalida lo que escribe en cada store (el primario al escribir y cada espejo
+al vaciar su cola); el archivo y la poda invalidan el vehículo entero.
+Los baldes se llenan en streaming, uno por vez, y los de más de
+``HISTORY_CACHE_MAX_BUCKET_ROWS`` filas se leen directo sin guardarse.
+"""
+import logging
+import threading
+import uuid
+from itertools import chain, groupby, islice
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import archive
+from .stores import STORES
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidated': 0, 'bypassed': 0, 'oversized': 0, 'errors': 0}
+
+
+def _bucket_size() -> int:
+    return getattr(settings, 'HISTORY_CACHE_BUCKET', 3600)
+
+
+def _floor(dt: datetime) -> datetime:
+    size = _bucket_size()
+    epoch = int(dt.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % size, tz=dt_timezone.utc)
+
+
+def _key(vehicle_id: int, source: str, start: datetime) -> str:
+    return f'hist:{vehicle_id}:{source}:{int(start.timestamp())}'
+
+
+def _version_key(vehicle_id: int, source: str, start: datetime) -> str:
+    return _key(vehicle_id, source, start) + ':v'
+
+
+def _gen_key(vehicle_id: int) -> str:
+    return f'hist:{vehicle_id}:gen'
+
+
+def _version_ttl() -> int:
+    # tiene que sobrevivir a cualquier balde guardado con la versión anterior
+    return 2 * getattr(settings, 'HISTORY_CACHE_TTL', 86400)
+
+
+def _count(name, n=1):
+    with _lock:
+        _stats[name] += n
+
+
+def _pack(rows: list) -> dict:
+    n = len(rows)
+    return {
+        'ts': np.fromiter(((r[0] - EPOCH) // timedelta(microseconds=1) for r in rows), np.int64, n),
+        'lat': np.fromiter((r[1] for r in rows), np.float64, n),
+        'lng': np.fromiter((r[2] for r in rows), np.float64, n),
+        'speed': np.fromiter((r[3] for r in rows), np.float64, n),
+        'sq': np.fromiter((r[4] for r in rows), np.int64, n),
+        'on': np.fromiter((r[5] for r in rows), bool, n),
+    }
+
+
+def _unpack(cols: dict, dt_from: datetime, dt_to: datetime):
+    ts = cols['ts']
+    lo = np.searchsorted(ts, (dt_from - EPOCH) // timedelta(microseconds=1), side='left')
+    hi = np.searchsorted(ts, (dt_to - EPOCH) // timedelta(microseconds=1), side='right')
+    ts = ts[lo:hi].tolist()
+    lat, lng = cols['lat'][lo:hi].tolist(), cols['lng'][lo:hi].tolist()
+    speed, sq, on = cols['speed'][lo:hi].tolist(), cols['sq'][lo:hi].tolist(), cols['on'][lo:hi].tolist()
+    for i, us in enumerate(ts):
+        yield (EPOCH + timedelta(microseconds=us), lat[i], lng[i], speed[i], sq[i], on[i])
+
+
+def _fill(vehicle_id, store, starts, versions, now, dt_from, dt_to):
+    """Lee en una sola consulta un tramo contiguo de baldes faltantes y los
+    guarda y devuelve de a uno, sin juntar el tramo entero en memoria."""
+    size = timedelta(seconds=_bucket_size())
+    max_rows = getattr(settings, 'HISTORY_CACHE_MAX_BUCKET_ROWS', 20000)
+    rows = archive.query_range(vehicle_id, starts[0], starts[-1] + size - timedelta(microseconds=1), store)
+    groups = groupby(rows, key=lambda row: _floor(row[0]))
+    group = next(groups, None)
+    for start in starts:
+        rest = group[1] if group is not None and group[0] == start else iter(())
+        bucket_rows = list(islice(rest, max_rows + 1))
+        if len(bucket_rows) > max_rows:
+            # balde demasiado grande para la caché: se pasa tal cual
+            _count('oversized')
+            for row in chain(bucket_rows, rest):
+                if dt_from <= row[0] <= dt_to:
+                    yield row
+        else:
+            cols = _pack(bucket_rows)
+            closed = start + size <= now
+            ttl = getattr(settings, 'HISTORY_CACHE_TTL', 86400) if closed else getattr(settings, 'HISTORY_CACHE_OPEN_TTL', 30)
+            try:
+                cache.set(_key(vehicle_id, store.name, start), (versions[start], cols), ttl)
+            except Exception:
+                _count('errors')
+            yield from _unpack(cols, dt_from, dt_to)
+        if group is not None and group[0] == start:
+            # groupby invalida el grupo anterior al avanzar: recién acá
+            group = next(groups, None)
+
+
+def query_range(vehicle_id: int, dt_from: datetime, dt_to: datetime, store):
+    """Igual que ``archive.query_range`` pero pasando por la caché. Rangos más
+    largos que ``HISTORY_CACHE_MAX_SPAN_DAYS`` van directo (en streaming)."""
+    max_span = timedelta(days=getattr(settings, 'HISTORY_CACHE_MAX_SPAN_DAYS', 8))
+    if not getattr(settings, 'HISTORY_CACHE_ENABLED', True) or dt_to - dt_from > max_span or dt_to < dt_from:
+        _count('bypassed')
+        yield from archive.query_range(vehicle_id, dt_from, dt_to, store)
+        return
+
+    size = timedelta(seconds=_bucket_size())
+    starts = []
+    start = _floor(dt_from)
+    while start <= dt_to:
+        starts.append(start)
+        start += size
+    keys = {start: _key(vehicle_id, store.name, start) for start in starts}
+    version_keys = {start: _version_key(vehicle_id, store.name, start) for start in starts}
+    gen_key = _gen_key(vehicle_id)
+    try:
+        found = cache.get_many(list(keys.values()) + list(version_keys.values()) + [gen_key])
+    except Exception:
+        # caché caída: se lee directo
+        logger.warning('No se pudo leer la caché de historial')
+        _count('errors')
+        found = {}
+    gen = found.get(gen_key)
+    versions = {start: (gen, found.get(version_keys[start])) for start in starts}
+    buckets = {}
+    for start, key in keys.items():
+        entry = found.get(key)
+        if entry is not None and entry[0] == versions[start]:
+            buckets[start] = entry[1]
+    _count('hits', len(buckets))
+    _count('misses', len(starts) - len(buckets))
+
+    now = timezone.now()
+    run = []
+    for start in starts + [None]:
+        if start is not None and start not in buckets:
+            run.append(start)
+            continue
+        if run:
+            yield from _fill(vehicle_id, store, run, versions, now, dt_from, dt_to)
+            run = []
+        if start is not None:
+            yield from _unpack(buckets[start], dt_from, dt_to)
+
+
+def invalidate(vehicle_id: int, timestamps, sources=None):
+    """Cambia la versión de los baldes que contienen ``timestamps`` en los
+    stores ``sources`` (todos por defecto)."""
+    starts = {_floor(ts) for ts in timestamps}
+    if not starts:
+        return
+    token = uuid.uuid4().hex
+    keys = {_version_key(vehicle_id, name, start): token
+            for start in starts for name in (sources or STORES)}
+    try:
+        cache.set_many(keys, _version_ttl())
+    except Exception:
+        logger.warning('No se pudo invalidar la caché de historial del vehículo %s', vehicle_id)
+        _count('errors')
+        return
+    _count('invalidated', len(starts))
+
+
+def invalidate_vehicle(vehicle_id: int):
+    """Invalida todos los baldes del vehículo (archivo y poda)."""
+    try:
+        cache.set(_gen_key(vehicle_id), uuid.uuid4().hex, _version_ttl())
+    except Exception:
+        logger.warning('No se pudo invalidar la caché de historial del vehículo %s', vehicle_id)
+        _count('errors')
+
+
+def snapshot() -> dict:
+    with _lock:
+        stats = dict(_stats)
+    total = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / total, 3) if total else None
+    return stats
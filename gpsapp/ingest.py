@@ -0,0 +1,303 @@
+import atexit
+import logging
+import signal
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DateTimeField, F, Q, Value
+from django.db.models.functions import Coalesce, Least
+from django.utils import timezone
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from .broadcaster import get_broadcaster
+from .models import Vehicle
+from . import history_cache, live, mongo, registry, thinning
+from .stores import get_store, mirror_names
+from .writer import HistoryWriter, IngestQueueFull
+
+
+logger = logging.getLogger(__name__)
+
+
+class FixError(ValueError):
+    pass
+
+
+class DeviceNotFound(Exception):
+    pass
+
+
+def parse_fix(data: dict) -> dict:
+    """Valida un fix crudo del dispositivo y lo normaliza.
+
+    Acepta opcionalmente ``ts`` (epoch en segundos) para los fixes que el
+    equipo almacena y reenvía en lote; si no viene se usa la hora actual.
+    """
+    lat = data.get('lat')
+    lng = data.get('lng')
+    if not lat or not lng:
+        raise FixError('Faltan datos requeridos.')
+    try:
+        fix = {
+            'lat': float(lat),
+            'lng': float(lng),
+            'speed': float(data.get('speed', 0.0)),
+            'signal_quality': int(data.get('signal_quality', 0)),
+            'vehicle_on': bool(data.get('vehicle_on', False)),
+        }
+    except Exception:
+        raise FixError('Lat/Lng/Velocidad/Señal inválidos.')
+    ts = data.get('ts')
+    if ts is None:
+        fix['timestamp'] = timezone.now()
+    else:
+        try:
+            fix['timestamp'] = datetime.fromtimestamp(float(ts), tz=dt_timezone.utc)
+        except Exception:
+            raise FixError('Timestamp inválido.')
+    return fix
+
+
+def has_position(fix: dict) -> bool:
+    return fix['lat'] != 0.0 or fix['lng'] != 0.0
+
+
+def write_batch(entries: list) -> int:
+    """Persiste un lote de entradas ``(vehicle_id, fix, now_str)``.
+
+    El historial se escribe una sola vez, en el store primario
+    (``HISTORY_STORE``); los espejos (``HISTORY_MIRRORS``) reciben el lote por
+    su propia cola. La fila de cada ``Vehicle`` se actualiza sólo con su fix
+    más reciente, y sólo si no es más viejo que el que ya tiene
+    (``last_fix_ts``). Los fixes marcados con ``history=False`` (ver ``thinning``)
+    sólo actualizan la posición en vivo.
+    """
+    latest = {}
+    for vid, fix, now_str in entries:
+        cur = latest.get(vid)
+        if cur is None or fix['timestamp'] >= cur[0]['timestamp']:
+            latest[vid] = (fix, now_str)
+    # un vehículo borrado mientras sus fixes esperaban en cola no debe tirar el lote
+    existing = set(Vehicle.objects.filter(id__in=list(latest)).values_list('id', flat=True))
+    history = [(vid, f) for vid, f, _ in entries if vid in existing and f.get('history', True)]
+    if not existing:
+        return 0
+
+    earliest = {}
+    for vid, f in history:
+        if vid not in earliest or f['timestamp'] < earliest[vid]:
+            earliest[vid] = f['timestamp']
+
+    moved = set()
+    with transaction.atomic():
+        if history:
+            get_store().append_many(history)
+        for vid in existing:
+            f, now_str = latest[vid]
+            if vid in earliest:
+                ts = Value(earliest[vid], output_field=DateTimeField())
+                # MIN(NULL, x) es NULL en SQLite: Coalesce cubre el primer lote
+                Vehicle.objects.filter(id=vid).update(**{
+                    name: Coalesce(Least(F(name), ts), ts) for name in Vehicle.DIRTY_FIELDS})
+            newer = Q(last_fix_ts__isnull=True) | Q(last_fix_ts__lte=f['timestamp'])
+            if Vehicle.objects.filter(newer, id=vid).update(
+                lat=f['lat'], lng=f['lng'], speed=f['speed'],
+                signal_quality=f['signal_quality'], vehicle_on=f['vehicle_on'],
+                last_updated=now_str, last_fix_ts=f['timestamp'],
+            ):
+                moved.add(vid)
+    if history:
+        _invalidate_cache(history, [get_store().name])
+        for name in mirror_names():
+            try:
+                get_mirror_writer(name).submit(history)
+            except IngestQueueFull:
+                pass
+
+    # posición en vivo en Mongo: un solo bulk desordenado para todo el lote,
+    # sólo para las filas que la condición de arriba dejó avanzar
+    if not moved:
+        return len(history)
+    try:
+        mongo.bulk_write('vehicles', [
+            UpdateOne({'vehicle_id': vid}, {'$set': {
+                'lat': latest[vid][0]['lat'],
+                'lng': latest[vid][0]['lng'],
+                'speed': latest[vid][0]['speed'],
+                'signal_quality': latest[vid][0]['signal_quality'],
+                'vehicle_on': latest[vid][0]['vehicle_on'],
+                'last_updated': latest[vid][1],
+            }}, upsert=True)
+            for vid in moved
+        ])
+    except PyMongoError:
+        # ya contado en mongo.snapshot(); no frena la ingesta
+        pass
+    return len(history)
+
+
+def _invalidate_cache(history: list, sources: list):
+    # baldes de la caché de lecturas que recibieron puntos nuevos
+    touched = {}
+    for vid, f in history:
+        touched.setdefault(vid, []).append(f['timestamp'])
+    for vid, stamps in touched.items():
+        history_cache.invalidate(vid, stamps, sources)
+
+
+def _mirror_sink(name: str):
+    store = get_store(name)
+
+    def sink(history: list):
+        store.append_many(history)
+        # el espejo recién tiene los puntos ahora: invalidar antes dejaría
+        # que una lectura guarde el balde viejo
+        _invalidate_cache(history, [name])
+    return sink
+
+
+_writer = None
+_mirror_writers = {}
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> HistoryWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = HistoryWriter(
+                write_batch,
+                maxsize=getattr(settings, 'INGEST_QUEUE_MAXSIZE', 10000),
+                flush_interval=getattr(settings, 'INGEST_FLUSH_INTERVAL', 1.0),
+                flush_max=getattr(settings, 'INGEST_FLUSH_MAX_FIXES', 500),
+            )
+    return _writer
+
+
+def get_mirror_writer(name: str) -> HistoryWriter:
+    # cola propia por espejo: un espejo lento o caído no frena al primario
+    with _writer_lock:
+        if name not in _mirror_writers:
+            w = HistoryWriter(
+                _mirror_sink(name),
+                maxsize=getattr(settings, 'INGEST_QUEUE_MAXSIZE', 10000),
+                flush_interval=getattr(settings, 'INGEST_FLUSH_INTERVAL', 1.0),
+                flush_max=getattr(settings, 'INGEST_FLUSH_MAX_FIXES', 500),
+            )
+            _mirror_writers[name] = w
+    return _mirror_writers[name]
+
+
+def stop_writers():
+    """Vacía las colas: primero el primario (que todavía encola en los
+    espejos) y después los espejos."""
+    with _writer_lock:
+        primary, mirrors = _writer, list(_mirror_writers.values())
+    if primary is not None:
+        primary.stop()
+    for w in mirrors:
+        w.stop()
+
+
+atexit.register(stop_writers)
+
+
+def install_shutdown_handlers():
+    """SIGTERM/SIGINT vacían las colas antes de salir (atexit no corre si el
+    proceso muere por la señal). Encadena el handler previo."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        prev = signal.getsignal(sig)
+
+        def handler(signum, frame, prev=prev):
+            stop_writers()
+            if callable(prev):
+                prev(signum, frame)
+            elif prev != signal.SIG_IGN:
+                raise SystemExit(128 + signum)
+
+        signal.signal(sig, handler)
+
+
+def writer_stats() -> dict:
+    stats = {'primary': get_store().name, 'queue': get_writer().snapshot()}
+    stats['mirrors'] = {name: get_mirror_writer(name).snapshot() for name in mirror_names()}
+    stats['mongo'] = mongo.snapshot()
+    stats['broadcast'] = get_broadcaster().snapshot()
+    return stats
+
+
+async def asubmit_fixes(vehicle_id: int, fixes: list, now_str: str) -> int:
+    """Encola (o escribe, si la escritura diferida está apagada) los fixes
+    con posición válida. Lanza ``IngestQueueFull`` si la cola está llena.
+    Devuelve cuántos van al historial después del raleo.
+
+    Encolar no bloquea (``put_nowait``); sólo la escritura directa sale del
+    event loop.
+    """
+    fixes = [f for f in fixes if has_position(f)]
+    if not fixes:
+        return 0
+    previous = thinning.last_kept(vehicle_id)
+    kept = thinning.mark(vehicle_id, fixes)
+    entries = [(vehicle_id, f, now_str) for f in fixes]
+    try:
+        if getattr(settings, 'INGEST_WRITE_BEHIND', True):
+            get_writer().submit(entries)
+        else:
+            await sync_to_async(write_batch)(entries)
+    except Exception:
+        thinning.rollback(vehicle_id, previous, fixes)
+        raise
+    return kept
+
+
+def live_payload(v: Vehicle, fix: dict, now_str: str) -> dict:
+    return {
+        'vehicle_id': str(v.id),
+        'lat': fix['lat'],
+        'lng': fix['lng'],
+        'speed': fix['speed'],
+        'signal_quality': fix['signal_quality'],
+        'vehicle_on': fix['vehicle_on'],
+        'shutdown': bool(v.shutdown),
+        'transmit_audio': bool(v.transmit_audio),
+        'last_updated': now_str,
+        # hora del fix (ms desde epoch): descarta los que llegan fuera de orden
+        'fix_ts': round(fix['timestamp'].timestamp() * 1000),
+    }
+
+
+async def abroadcast_vehicle(vehicle_id: int, payload: dict, user_id: int = None):
+    """Publica en ``vehicle_<id>`` y, si se conoce el dueño, en su grupo de
+    flota ``fleet_<user_id>`` (coalescido, ver ``gpsapp.broadcaster``). El
+    estado en vivo (``gpsapp.live``) se actualiza acá, una vez por evento; un
+    fix más viejo que el estado guardado no se publica."""
+    if not await live.aupdate(vehicle_id, payload):
+        return
+    await get_broadcaster().publish(vehicle_id, payload, user_id)
+
+
+async def aingest(device_id: str, fixes: list):
+    """Camino común de ingesta (HTTP y listener TCP/UDP).
+
+    Resuelve el dispositivo, encola los fixes y hace un solo broadcast con
+    el más reciente. Devuelve ``(entry, now_str, guardados)``.
+    """
+    v = await registry.alookup(device_id)
+    if v is None:
+        raise DeviceNotFound(device_id)
+    now_str = datetime.now().strftime('%d-%m-%Y %H:%M')
+    stored = await asubmit_fixes(v.id, fixes, now_str)
+    if fixes:
+        last = max(fixes, key=lambda f: f['timestamp'])
+        try:
+            await abroadcast_vehicle(v.id, live_payload(v, last, now_str), v.user_id)
+        except Exception:
+            pass
+    return v, now_str, stored
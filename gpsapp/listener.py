@@ -0,0 +1,289 @@
+import asyncio
+import json
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import registry
+from .ingest import FixError, DeviceNotFound, parse_fix, aingest
+from .protocol import (BINARY_VERSION, FRAME_HEADER, FRAME_MAGIC, REPLY_ERROR, decode_binary, decode_nmea,
+                       encode_reply)
+from .writer import IngestQueueFull
+
+
+logger = logging.getLogger(__name__)
+
+# el loop guarda las tareas con referencias débiles: sin esto una tarea en
+# curso puede ser recolectada y sus errores sólo se ven al final del proceso
+_tasks = set()
+
+
+def _task_done(task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('Falló una tarea del listener', exc_info=task.exception())
+
+
+def _spawn(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_task_done)
+    return task
+
+
+class DeviceHub:
+    """Sockets TCP abiertos por vehículo.
+
+    Se suscribe a los grupos ``vehicle_<id>`` del channel layer para que los
+    comandos (``shutdown``/``transmit_audio``) disparados desde la web lleguen
+    al equipo en el momento, sin esperar a su próximo envío.
+    """
+
+    def __init__(self):
+        self.channel_layer = get_channel_layer()
+        self.channel = None
+        self.conns = {}  # vehicle_id -> set(DeviceConnection)
+
+    async def start(self):
+        self.channel = await self.channel_layer.new_channel()
+        _spawn(self._pump())
+
+    async def attach(self, vehicle_id, conn):
+        if vehicle_id not in self.conns:
+            self.conns[vehicle_id] = set()
+            await self.channel_layer.group_add(f"vehicle_{vehicle_id}", self.channel)
+        self.conns[vehicle_id].add(conn)
+
+    async def detach(self, vehicle_id, conn):
+        conns = self.conns.get(vehicle_id)
+        if not conns:
+            return
+        conns.discard(conn)
+        if not conns:
+            del self.conns[vehicle_id]
+            await self.channel_layer.group_discard(f"vehicle_{vehicle_id}", self.channel)
+
+    async def _pump(self):
+        while True:
+            try:
+                message = await self.channel_layer.receive(self.channel)
+            except Exception:
+                logger.exception('Error leyendo del channel layer')
+                await asyncio.sleep(1)
+                continue
+            # ``frames.event`` deja el comando suelto: no hace falta decodificar
+            command = message.get('command')
+            if not command:
+                continue
+            try:
+                vehicle_id = int(message.get('vehicle_id'))
+            except (TypeError, ValueError):
+                continue
+            # el flag cambió en otro proceso: la entrada cacheada ya no sirve
+            registry.forget_vehicle(vehicle_id)
+            for conn in list(self.conns.get(vehicle_id, ())):
+                await conn.push_state(command)
+
+
+class DeviceConnection:
+    def __init__(self, hub, reader, writer):
+        self.hub = hub
+        self.reader = reader
+        self.writer = writer
+        self.binary = False
+        self.device_id = None
+        self.vehicle_id = None
+        self.idle_timeout = getattr(settings, 'GPS_LISTENER_IDLE_TIMEOUT', 300)
+
+    async def _read(self, coro):
+        # sockets medio abiertos (el equipo perdió señal sin cerrar) no quedan colgados
+        return await asyncio.wait_for(coro, self.idle_timeout)
+
+    async def run(self):
+        peer = self.writer.get_extra_info('peername')
+        try:
+            first = await self._read(self.reader.read(1))
+            if not first:
+                return
+            # JSON/NMEA por líneas o frames binarios con byte mágico
+            if first[0] == FRAME_MAGIC:
+                self.binary = True
+                await self._run_binary(first)
+            elif first in (b'{', b'$'):
+                await self._run_text(first)
+            else:
+                logger.warning('Conexión %s con formato desconocido (0x%02x)', peer, first[0])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.TimeoutError:
+            logger.info('Conexión %s inactiva por más de %ss; se cierra', peer, self.idle_timeout)
+        except Exception:
+            logger.exception('Error en conexión de dispositivo %s', peer)
+        finally:
+            if self.vehicle_id is not None:
+                await self.hub.detach(self.vehicle_id, self)
+            self.writer.close()
+
+    async def _run_text(self, first):
+        line = first + await self._read(self.reader.readline())
+        while line:
+            await self._handle_text(line.decode('utf-8', errors='ignore').strip())
+            line = await self._read(self.reader.readline())
+
+    async def _run_binary(self, first):
+        head = first + await self._read(self.reader.readexactly(FRAME_HEADER.size - 1))
+        while True:
+            magic, size = FRAME_HEADER.unpack(head)
+            if magic != FRAME_MAGIC:
+                # se perdió la sincronía del stream: no hay forma segura de seguir
+                self.writer.write(bytes((REPLY_ERROR,)))
+                return
+            body = await self._read(self.reader.readexactly(size))
+            try:
+                device_id, fixes = decode_binary(body)
+                await self._ingest(device_id, fixes)
+            except (FixError, DeviceNotFound, IngestQueueFull):
+                self.writer.write(bytes((REPLY_ERROR,)))
+            await self.writer.drain()
+            head = await self._read(self.reader.readexactly(FRAME_HEADER.size))
+
+    async def _handle_text(self, text):
+        if not text:
+            return
+        try:
+            if text.startswith('$'):
+                if not self.device_id:
+                    raise FixError('Dispositivo no identificado.')
+                fixes = decode_nmea(text)
+                device_id = self.device_id
+            else:
+                try:
+                    data = json.loads(text)
+                except Exception:
+                    raise FixError('JSON inválido')
+                device_id = data.get('device_id') or self.device_id
+                if not device_id:
+                    raise FixError('Faltan datos requeridos.')
+                if isinstance(data.get('fixes'), list):
+                    fixes = []
+                    for raw in data['fixes']:
+                        try:
+                            fixes.append(parse_fix(raw if isinstance(raw, dict) else {}))
+                        except FixError:
+                            continue
+                elif 'lat' in data:
+                    fixes = [parse_fix(data)]
+                else:
+                    # línea de saludo: sólo identifica al equipo
+                    fixes = []
+            v, now_str = await self._ingest(device_id, fixes)
+        except FixError as e:
+            return await self._send_json({'status': 'error', 'message': str(e)})
+        except DeviceNotFound:
+            return await self._send_json({'status': 'error', 'message': 'Dispositivo no encontrado.'})
+        except IngestQueueFull:
+            return await self._send_json({'status': 'error', 'message': 'Servidor ocupado, reintentar.'})
+        await self._send_json({
+            'status': 'success',
+            'shutdown': bool(v.shutdown),
+            'transmit_audio': bool(v.transmit_audio),
+            'last_updated': now_str,
+        })
+
+    async def _ingest(self, device_id, fixes):
+        v, now_str, _ = await aingest(device_id, fixes)
+        if self.vehicle_id != v.id:
+            if self.vehicle_id is not None:
+                await self.hub.detach(self.vehicle_id, self)
+            self.vehicle_id = v.id
+            await self.hub.attach(v.id, self)
+        self.device_id = device_id
+        if self.binary:
+            self.writer.write(encode_reply(v.shutdown, v.transmit_audio))
+        return v, now_str
+
+    async def push_state(self, command):
+        v = await registry.alookup(self.device_id) if self.device_id else None
+        if v is None:
+            return
+        try:
+            if self.binary:
+                self.writer.write(encode_reply(v.shutdown, v.transmit_audio))
+                await self.writer.drain()
+            else:
+                await self._send_json({
+                    'status': 'command',
+                    'command': command,
+                    'shutdown': bool(v.shutdown),
+                    'transmit_audio': bool(v.transmit_audio),
+                })
+        except ConnectionError:
+            pass
+
+    async def _send_json(self, data):
+        self.writer.write(json.dumps(data).encode('utf-8') + b'\n')
+        await self.writer.drain()
+
+
+class DatagramIngest(asyncio.DatagramProtocol):
+    """Un datagrama = un mensaje (JSON o binario); la respuesta va al emisor."""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        _spawn(self._handle(data, addr))
+
+    async def _handle(self, data, addr):
+        binary = bool(data) and data[0] == BINARY_VERSION
+        try:
+            if binary:
+                device_id, fixes = decode_binary(data)
+            else:
+                try:
+                    payload = json.loads(data.decode('utf-8'))
+                except Exception:
+                    raise FixError('JSON inválido')
+                device_id = payload.get('device_id')
+                if not device_id:
+                    raise FixError('Faltan datos requeridos.')
+                fixes = [parse_fix(payload)]
+            v, now_str, _ = await aingest(device_id, fixes)
+        except (FixError, DeviceNotFound, IngestQueueFull) as e:
+            if binary:
+                reply = bytes((REPLY_ERROR,))
+            else:
+                message = str(e) if isinstance(e, FixError) else (
+                    'Dispositivo no encontrado.' if isinstance(e, DeviceNotFound) else 'Servidor ocupado, reintentar.')
+                reply = json.dumps({'status': 'error', 'message': message}).encode('utf-8')
+        else:
+            if binary:
+                reply = encode_reply(v.shutdown, v.transmit_audio)
+            else:
+                reply = json.dumps({
+                    'status': 'success',
+                    'shutdown': bool(v.shutdown),
+                    'transmit_audio': bool(v.transmit_audio),
+                    'last_updated': now_str,
+                }).encode('utf-8')
+        self.transport.sendto(reply, addr)
+
+
+async def serve(host: str, tcp_port: int, udp_port: int):
+    hub = DeviceHub()
+    await hub.start()
+    servers = []
+    if tcp_port:
+        server = await asyncio.start_server(
+            lambda r, w: DeviceConnection(hub, r, w).run(), host, tcp_port)
+        servers.append(server)
+        logger.info('Escuchando TCP en %s:%s', host, tcp_port)
+    if udp_port:
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(DatagramIngest, local_addr=(host, udp_port))
+        logger.info('Escuchando UDP en %s:%s', host, udp_port)
+    if servers:
+        await asyncio.gather(*(s.serve_forever() for s in servers))
+    else:
+        await asyncio.Event().wait()
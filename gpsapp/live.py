@@ -0,0 +1,181 @@
+"""Estado en vivo de cada vehículo (última posición y flags).
+
+Se actualiza una vez por evento en ``abroadcast_vehicle`` (fix o comando) y
+se lee sin tocar SQLite: snapshot al conectar un WebSocket y overlay de los
+campos en vivo en ``dashboard``/``vehicle_map``. Con ``REDIS_URL`` vive en
+hashes ``live:<vehicle_id>`` (compartido entre procesos, valores en JSON);
+si no, en un dict del proceso. La fila durable de ``vehicles`` la sigue
+escribiendo el writer diferido por lotes.
+
+Los payloads de fixes traen ``fix_ts`` (ms desde epoch, hora del equipo): uno
+más viejo que el guardado (reintentos, equipos que vacían su buffer, otro
+proceso que publicó después) se descarta entero. Los comandos no lo traen y
+se aplican siempre.
+"""
+import json
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# campos de estado (el resto del payload, como ``command``, es un evento)
+FIELDS = ('lat', 'lng', 'speed', 'signal_quality', 'vehicle_on', 'shutdown', 'transmit_audio', 'last_updated',
+          'fix_ts')
+
+# HSET condicionado a que el fix_ts guardado no sea más nuevo; ARGV: fix_ts
+# (o ''), ttl, campo, valor, campo, valor...
+_UPDATE_SCRIPT = """
+local cur = redis.call('HGET', KEYS[1], 'fix_ts')
+if ARGV[1] ~= '' and cur and tonumber(ARGV[1]) < tonumber(cur) then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+if tonumber(ARGV[2]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+
+def is_older(fields: dict, state: dict) -> bool:
+    """Si ``fields`` trae un fix más viejo que el de ``state``."""
+    ts, cur = fields.get('fix_ts'), state.get('fix_ts')
+    return ts is not None and cur is not None and ts < cur
+
+
+class MemoryLiveStore:
+    blocking = False
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def update(self, vehicle_id: int, fields: dict) -> bool:
+        with self._lock:
+            state = self._state.setdefault(vehicle_id, {})
+            if is_older(fields, state):
+                return False
+            state.update(fields)
+            return True
+
+    def get_many(self, vehicle_ids) -> dict:
+        with self._lock:
+            return {vid: dict(self._state[vid]) for vid in vehicle_ids if vid in self._state}
+
+    def forget(self, vehicle_id: int):
+        with self._lock:
+            self._state.pop(vehicle_id, None)
+
+
+class RedisLiveStore:
+    blocking = True
+
+    def __init__(self, url: str, ttl: int):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self._update = self.client.register_script(_UPDATE_SCRIPT)
+
+    @staticmethod
+    def _key(vehicle_id):
+        return f'live:{vehicle_id}'
+
+    def update(self, vehicle_id, fields):
+        args = [fields['fix_ts'] if fields.get('fix_ts') is not None else '', self.ttl or 0]
+        for k, v in fields.items():
+            args += [k, json.dumps(v)]
+        return bool(self._update(keys=[self._key(vehicle_id)], args=args))
+
+    def get_many(self, vehicle_ids):
+        vehicle_ids = list(vehicle_ids)
+        pipe = self.client.pipeline(transaction=False)
+        for vid in vehicle_ids:
+            pipe.hgetall(self._key(vid))
+        out = {}
+        for vid, raw in zip(vehicle_ids, pipe.execute()):
+            if raw:
+                out[vid] = {k.decode(): json.loads(v) for k, v in raw.items()}
+        return out
+
+    def forget(self, vehicle_id):
+        self.client.delete(self._key(vehicle_id))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_live_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            url = getattr(settings, 'REDIS_URL', None)
+            _store = (RedisLiveStore(url, getattr(settings, 'LIVE_STATE_TTL', 7 * 86400)) if url
+                      else MemoryLiveStore())
+    return _store
+
+
+def update(vehicle_id: int, payload: dict) -> bool:
+    """``False`` si el payload es de un fix más viejo que el guardado y se
+    descartó; si el store falla se sigue como si se hubiera aplicado."""
+    fields = {k: payload[k] for k in FIELDS if k in payload}
+    if not fields:
+        return True
+    try:
+        return get_live_store().update(vehicle_id, fields)
+    except Exception:
+        logger.warning('No se pudo actualizar el estado en vivo del vehículo %s', vehicle_id)
+        return True
+
+
+def get_many(vehicle_ids) -> dict:
+    """``{vehicle_id: campos}`` de los vehículos con estado; vacío si el store falla."""
+    try:
+        return get_live_store().get_many(vehicle_ids)
+    except Exception:
+        logger.warning('No se pudo leer el estado en vivo')
+        return {}
+
+
+async def aupdate(vehicle_id: int, payload: dict) -> bool:
+    if get_live_store().blocking:
+        return await sync_to_async(update, thread_sensitive=False)(vehicle_id, payload)
+    return update(vehicle_id, payload)
+
+
+async def aget_many(vehicle_ids) -> dict:
+    if get_live_store().blocking:
+        return await sync_to_async(get_many, thread_sensitive=False)(list(vehicle_ids))
+    return get_many(vehicle_ids)
+
+
+def overlay(vehicles):
+    """Pisa los campos en vivo de instancias ``Vehicle`` con el estado del store."""
+    vehicles = list(vehicles)
+    state = get_many(v.id for v in vehicles)
+    for v in vehicles:
+        for k, value in state.get(v.id, {}).items():
+            setattr(v, k, value)
+    return vehicles
+
+
+def _forget(vehicle_id: int):
+    try:
+        get_live_store().forget(vehicle_id)
+    except Exception:
+        logger.warning('No se pudo borrar el estado en vivo del vehículo %s', vehicle_id)
+
+
+def on_vehicle_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    # un guardado completo (edición del admin) manda sobre el estado en vivo
+    # hasta el próximo fix; los guardados parciales de flags ya lo actualizan
+    # por ``abroadcast_vehicle``
+    if update_fields is None:
+        _forget(instance.id)
+
+
+def on_vehicle_deleted(sender, instance, **kwargs):
+    _forget(instance.id)
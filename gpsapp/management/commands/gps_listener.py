@@ -0,0 +1,25 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gpsapp.ingest import install_shutdown_handlers
+from gpsapp.listener import serve
+
+
+class Command(BaseCommand):
+    help = 'Listener TCP/UDP para equipos GPS (alternativa al POST HTTPS).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default=getattr(settings, 'GPS_LISTENER_HOST', '0.0.0.0'))
+        parser.add_argument('--tcp-port', type=int, default=getattr(settings, 'GPS_LISTENER_TCP_PORT', 5055))
+        parser.add_argument('--udp-port', type=int, default=getattr(settings, 'GPS_LISTENER_UDP_PORT', 5056),
+                            help='0 para desactivar UDP')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Listener GPS en {options['host']} (TCP {options['tcp_port']}, UDP {options['udp_port']})")
+        install_shutdown_handlers()
+        try:
+            asyncio.run(serve(options['host'], options['tcp_port'], options['udp_port']))
+        except KeyboardInterrupt:
+            pass
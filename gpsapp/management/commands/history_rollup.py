@@ -0,0 +1,68 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from gpsapp import archive, heatmap, rollups, trips
+from gpsapp.models import HistoryRollup
+from gpsapp.models import Vehicle
+
+
+class Command(BaseCommand):
+    help = ('Agrega el historial crudo en rollups por minuto y por hora, arma viajes, resúmenes '
+            'diarios y celdas del mapa de densidad, pasa los días viejos al archivo columnar y poda los datos más viejos que la '
+            'retención configurada.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicle', type=int, action='append', help='Sólo estos vehículos')
+        parser.add_argument('--no-prune', action='store_true', help='No borrar datos viejos')
+        parser.add_argument('--no-archive', action='store_true', help='No mover días al archivo columnar')
+        parser.add_argument('--no-trips', action='store_true', help='No actualizar viajes ni resúmenes diarios')
+        parser.add_argument('--no-heatmap', action='store_true', help='No actualizar el mapa de densidad')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Repetir cada N segundos (0 = una sola corrida)')
+
+    def handle(self, *args, **options):
+        while True:
+            self._run_once(options)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def _run_once(self, options):
+        ids = options['vehicle'] or list(Vehicle.objects.values_list('id', flat=True))
+        for vehicle_id in ids:
+            # fixes escritos desde la corrida anterior (pueden ser tardíos); cada
+            # pasada toma su propia marca, así las salteadas no la pierden
+            done = self._pass(vehicle_id, 'history_dirty_from', rollups.run_vehicle)
+            if not options['no_trips']:
+                # antes de archivar/podar: lee el crudo desde el último viaje cerrado
+                done.update(self._pass(vehicle_id, 'trips_dirty_from', trips.run_vehicle))
+            if not options['no_heatmap']:
+                done.update(self._pass(vehicle_id, 'heat_dirty_from', heatmap.run_vehicle))
+            archived = {} if options['no_archive'] else self._archive(vehicle_id)
+            removed = {} if options['no_prune'] else rollups.prune(vehicle_id)
+            if options['verbosity'] > 1 and (done or archived or removed):
+                self.stdout.write(f'vehículo {vehicle_id}: rollups {done}, archivados {archived}, borrados {removed}')
+
+    def _pass(self, vehicle_id, field, run):
+        dirty = rollups.take_dirty(vehicle_id, field)
+        try:
+            return run(vehicle_id, dirty_from=dirty)
+        except Exception:
+            rollups.restore_dirty(vehicle_id, dirty, field)
+            raise
+
+    def _archive(self, vehicle_id):
+        days = getattr(settings, 'HISTORY_ARCHIVE_AFTER_DAYS', 0)
+        if not days:
+            return {}
+        # sólo lo que ya está agregado, igual que la poda
+        covered = (HistoryRollup.objects.filter(vehicle_id=vehicle_id, resolution=HistoryRollup.MINUTE)
+                   .aggregate(m=Max('bucket'))['m'])
+        if covered is None:
+            return {}
+        return archive.archive_vehicle(vehicle_id, min(timezone.now() - timedelta(days=days), covered))
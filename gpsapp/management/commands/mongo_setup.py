@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+from gpsapp.mongo import get_db
+
+
+class Command(BaseCommand):
+    help = ('Crea location_history como colección time-series (timeField=timestamp, '
+            'metaField=vehicle_id), migra los documentos existentes y asegura índices.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--granularity', default='seconds', choices=['seconds', 'minutes', 'hours'])
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            self._setup(get_db(), options)
+        except PyMongoError as e:
+            raise CommandError(f'Mongo no disponible: {e}')
+
+    def _setup(self, db, options):
+        info = {c['name']: c for c in db.list_collections()}
+        hist = info.get('location_history')
+        legacy = None
+
+        if hist is None or hist.get('type') != 'timeseries':
+            if hist is not None:
+                legacy = 'location_history_legacy'
+                if legacy in info:
+                    raise CommandError(f'Ya existe {legacy}: terminá o descartá la migración anterior.')
+                db.location_history.rename(legacy)
+                self.stdout.write(f'location_history renombrada a {legacy}')
+            db.create_collection('location_history', timeseries={
+                'timeField': 'timestamp',
+                'metaField': 'vehicle_id',
+                'granularity': options['granularity'],
+            })
+            self.stdout.write('Creada location_history (time-series)')
+        elif 'location_history_legacy' in info:
+            # migración interrumpida: se retoma
+            legacy = 'location_history_legacy'
+
+        db.location_history.create_index([('vehicle_id', ASCENDING), ('timestamp', ASCENDING)])
+        db.vehicles.create_index([('vehicle_id', ASCENDING)])
+
+        if legacy:
+            self._migrate(db, legacy, options)
+
+        self.stdout.write(self.style.SUCCESS('Mongo listo'))
+
+    def _migrate(self, db, legacy, options):
+        src = db[legacy]
+        size = options['batch_size']
+        moved = 0
+        batch = []
+        # se borran del origen por lote y se conserva el _id: una corrida cortada
+        # entre el insert y el delete saltea al retomar lo que ya había copiado
+        for doc in src.find({'timestamp': {'$type': 'date'}}).sort('_id', ASCENDING).batch_size(size):
+            batch.append(doc)
+            if len(batch) >= size:
+                moved += self._move(db, src, batch)
+                batch = []
+        if batch:
+            moved += self._move(db, src, batch)
+        self.stdout.write(f'Migrados {moved} documentos')
+
+        skipped = src.estimated_document_count()
+        if skipped:
+            self.stdout.write(self.style.WARNING(f'{skipped} documentos sin timestamp válido quedaron en {legacy}'))
+        else:
+            src.drop()
+
+    def _move(self, db, src, batch):
+        ids = [doc['_id'] for doc in batch]
+        stamps = [doc['timestamp'] for doc in batch]
+        # time-series no tiene índice único por _id: se busca acotando por timestamp
+        done = {d['_id'] for d in db.location_history.find(
+            {'_id': {'$in': ids}, 'timestamp': {'$gte': min(stamps), '$lte': max(stamps)}}, {'_id': 1})}
+        todo = [doc for doc in batch if doc['_id'] not in done]
+        if todo:
+            db.location_history.insert_many(todo, ordered=False)
+        src.delete_many({'_id': {'$in': ids}})
+        return len(todo)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsapp', '0004_contactrequest_vehicle_device_phone_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='locationhistory',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsapp', '0005_location_history_fix_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='locationhistory',
+            index=models.Index(fields=['vehicle', 'timestamp'], name='loc_hist_vehicle_ts_idx'),
+        ),
+    ]
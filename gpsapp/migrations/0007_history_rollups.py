@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsapp', '0006_location_history_vehicle_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryRollup',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('resolution', models.CharField(choices=[('minute', 'Minuto'), ('hour', 'Hora')], max_length=8)),
+                ('bucket', models.DateTimeField()),
+                ('lat', models.FloatField()),
+                ('lng', models.FloatField()),
+                ('signal_quality', models.IntegerField(default=0)),
+                ('vehicle_on', models.BooleanField(default=False)),
+                ('max_speed', models.FloatField(default=0.0)),
+                ('avg_speed', models.FloatField(default=0.0)),
+                ('distance_m', models.FloatField(default=0.0)),
+                ('ignition_s', models.FloatField(default=0.0)),
+                ('samples', models.IntegerField(default=0)),
+                ('vehicle', models.ForeignKey(db_column='vehicle_id', on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='gpsapp.vehicle')),
+            ],
+            options={
+                'db_table': 'location_rollups',
+                'constraints': [models.UniqueConstraint(fields=('vehicle', 'resolution', 'bucket'), name='loc_rollup_vehicle_res_bucket')],
+            },
+        ),
+    ]
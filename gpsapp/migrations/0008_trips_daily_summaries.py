@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsapp', '0007_history_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySummary',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('trips', models.IntegerField(default=0)),
+                ('distance_m', models.FloatField(default=0.0)),
+                ('driving_s', models.FloatField(default=0.0)),
+                ('idle_s', models.FloatField(default=0.0)),
+                ('max_speed', models.FloatField(default=0.0)),
+                ('avg_speed', models.FloatField(default=0.0)),
+                ('vehicle', models.ForeignKey(db_column='vehicle_id', on_delete=django.db.models.deletion.CASCADE, related_name='daily_summaries', to='gpsapp.vehicle')),
+            ],
+            options={
+                'db_table': 'daily_summaries',
+                'constraints': [models.UniqueConstraint(fields=('vehicle', 'day'), name='daily_summary_vehicle_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Trip',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('start_lat', models.FloatField()),
+                ('start_lng', models.FloatField()),
+                ('end_lat', models.FloatField()),
+                ('end_lng', models.FloatField()),
+                ('distance_m', models.FloatField(default=0.0)),
+                ('duration_s', models.FloatField(default=0.0)),
+                ('idle_s', models.FloatField(default=0.0)),
+                ('max_speed', models.FloatField(default=0.0)),
+                ('avg_speed', models.FloatField(default=0.0)),
+                ('samples', models.IntegerField(default=0)),
+                ('open', models.BooleanField(default=False)),
+                ('vehicle', models.ForeignKey(db_column='vehicle_id', on_delete=django.db.models.deletion.CASCADE, related_name='trips', to='gpsapp.vehicle')),
+            ],
+            options={
+                'db_table': 'trips',
+                'indexes': [models.Index(fields=['vehicle', 'start'], name='trip_vehicle_start_idx')],
+            },
+        ),
+    ]
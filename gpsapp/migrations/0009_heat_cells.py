@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsapp', '0008_trips_daily_summaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatCell',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('ix', models.IntegerField()),
+                ('iy', models.IntegerField()),
+                ('samples', models.IntegerField(default=0)),
+                ('dwell_s', models.FloatField(default=0.0)),
+                ('vehicle', models.ForeignKey(db_column='vehicle_id', on_delete=django.db.models.deletion.CASCADE, related_name='heat_cells', to='gpsapp.vehicle')),
+            ],
+            options={
+                'db_table': 'heat_cells',
+                'indexes': [models.Index(fields=['vehicle', 'day', 'ix', 'iy'], name='heat_cell_vehicle_day_idx')],
+            },
+        ),
+    ]
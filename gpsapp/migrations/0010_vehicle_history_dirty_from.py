@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsapp', '0009_heat_cells'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='history_dirty_from',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsapp', '0010_vehicle_history_dirty_from'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='last_fix_ts',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
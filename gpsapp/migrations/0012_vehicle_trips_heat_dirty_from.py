@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+def copy_marker(apps, schema_editor):
+    # lo pendiente hasta ahora vale para las tres pasadas
+    Vehicle = apps.get_model('gpsapp', 'Vehicle')
+    Vehicle.objects.filter(history_dirty_from__isnull=False).update(
+        trips_dirty_from=models.F('history_dirty_from'), heat_dirty_from=models.F('history_dirty_from'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsapp', '0011_vehicle_last_fix_ts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='trips_dirty_from',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='heat_dirty_from',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_marker, reverse_code=migrations.RunPython.noop),
+    ]
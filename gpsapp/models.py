@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 import bcrypt
 
@@ -85,6 +86,15 @@ class Vehicle(models.Model):
     transmit_audio = models.BooleanField(default=False)
     speed = models.FloatField(default=0.0)
     last_updated = models.CharField(max_length=32, null=True, blank=True)
+    # fix más viejo escrito desde la última corrida de cada pasada de
+    # history_rollup (rollups, viajes, mapa de densidad): se rehace desde acá
+    # (fixes tardíos). Una marca por pasada, así saltear una no la pierde.
+    DIRTY_FIELDS = ('history_dirty_from', 'trips_dirty_from', 'heat_dirty_from')
+    history_dirty_from = models.DateTimeField(null=True, blank=True)
+    trips_dirty_from = models.DateTimeField(null=True, blank=True)
+    heat_dirty_from = models.DateTimeField(null=True, blank=True)
+    # hora del fix que dejó lat/lng: un fix más viejo (reenviado en lote) no la pisa
+    last_fix_ts = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = 'vehicles'
@@ -101,10 +111,107 @@ class LocationHistory(models.Model):
     speed = models.FloatField()
     signal_quality = models.IntegerField()
     vehicle_on = models.BooleanField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # default en lugar de auto_now_add: los lotes traen la hora real de cada fix
+    timestamp = models.DateTimeField(default=timezone.now)
 
     class Meta:
         db_table = 'location_history'
+        indexes = [
+            # rango por vehículo ordenado por fecha (api_vehicle_history)
+            models.Index(fields=['vehicle', 'timestamp'], name='loc_hist_vehicle_ts_idx'),
+        ]
+
+
+class HistoryRollup(models.Model):
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    RESOLUTION_CHOICES = ((MINUTE, 'Minuto'), (HOUR, 'Hora'))
+
+    id = models.AutoField(primary_key=True)
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, db_column='vehicle_id', related_name='rollups')
+    resolution = models.CharField(max_length=8, choices=RESOLUTION_CHOICES)
+    bucket = models.DateTimeField()
+    # última posición del intervalo
+    lat = models.FloatField()
+    lng = models.FloatField()
+    signal_quality = models.IntegerField(default=0)
+    vehicle_on = models.BooleanField(default=False)
+    max_speed = models.FloatField(default=0.0)
+    avg_speed = models.FloatField(default=0.0)
+    distance_m = models.FloatField(default=0.0)
+    ignition_s = models.FloatField(default=0.0)
+    samples = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'location_rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'resolution', 'bucket'], name='loc_rollup_vehicle_res_bucket'),
+        ]
+
+
+class Trip(models.Model):
+    """Viaje: tramo continuo con el vehículo activo (ignición o en
+    movimiento). Lo arma ``gpsapp.trips`` a partir del historial crudo."""
+    id = models.AutoField(primary_key=True)
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, db_column='vehicle_id', related_name='trips')
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    start_lat = models.FloatField()
+    start_lng = models.FloatField()
+    end_lat = models.FloatField()
+    end_lng = models.FloatField()
+    distance_m = models.FloatField(default=0.0)
+    duration_s = models.FloatField(default=0.0)
+    idle_s = models.FloatField(default=0.0)
+    max_speed = models.FloatField(default=0.0)
+    avg_speed = models.FloatField(default=0.0)
+    samples = models.IntegerField(default=0)
+    # el viaje sigue en curso: se recalcula en la próxima corrida
+    open = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = 'trips'
+        indexes = [
+            models.Index(fields=['vehicle', 'start'], name='trip_vehicle_start_idx'),
+        ]
+
+
+class DailySummary(models.Model):
+    """Totales por vehículo y día local (los viajes cuentan en el día en que
+    empiezan)."""
+    id = models.AutoField(primary_key=True)
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, db_column='vehicle_id', related_name='daily_summaries')
+    day = models.DateField()
+    trips = models.IntegerField(default=0)
+    distance_m = models.FloatField(default=0.0)
+    driving_s = models.FloatField(default=0.0)
+    idle_s = models.FloatField(default=0.0)
+    max_speed = models.FloatField(default=0.0)
+    avg_speed = models.FloatField(default=0.0)
+
+    class Meta:
+        db_table = 'daily_summaries'
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'day'], name='daily_summary_vehicle_day'),
+        ]
+
+
+class HeatCell(models.Model):
+    """Muestras y permanencia de un vehículo en una celda de la grilla
+    (``gpsapp.heatmap``) durante un día local."""
+    id = models.AutoField(primary_key=True)
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, db_column='vehicle_id', related_name='heat_cells')
+    day = models.DateField()
+    ix = models.IntegerField()
+    iy = models.IntegerField()
+    samples = models.IntegerField(default=0)
+    dwell_s = models.FloatField(default=0.0)
+
+    class Meta:
+        db_table = 'heat_cells'
+        indexes = [
+            models.Index(fields=['vehicle', 'day', 'ix', 'iy'], name='heat_cell_vehicle_day_idx'),
+        ]
 
 
 class ContactRequest(models.Model):
@@ -1,22 +1,110 @@
+import logging
 import os
-from urllib.parse import urlparse
-from pymongo import MongoClient
+import threading
+
 from django.conf import settings
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
 
 _client = None
+_db = None
+_lock = threading.Lock()
+
+# contadores del proceso, se ven en /api/ingest/stats
+_stats = {
+    'ops': 0,
+    'failures': 0,
+    'write_errors': 0,
+    'last_error': None,
+}
+
+
+def _write_concern():
+    w = getattr(settings, 'MONGO_WRITE_CONCERN', '1')
+    return int(w) if str(w).isdigit() else w
 
 
 def get_mongo_client():
     global _client
     if _client is None:
-        uri = getattr(settings, 'MONGO_URI', None) or os.getenv('MONGO_URI', 'mongodb://localhost:27017/gps_monitoring')
-        _client = MongoClient(uri)
+        with _lock:
+            if _client is None:
+                uri = getattr(settings, 'MONGO_URI', None) or os.getenv('MONGO_URI', 'mongodb://localhost:27017/gps_monitoring')
+                _client = MongoClient(
+                    uri,
+                    maxPoolSize=getattr(settings, 'MONGO_MAX_POOL_SIZE', 50),
+                    connectTimeoutMS=getattr(settings, 'MONGO_CONNECT_TIMEOUT_MS', 5000),
+                    serverSelectionTimeoutMS=getattr(settings, 'MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+                    socketTimeoutMS=getattr(settings, 'MONGO_SOCKET_TIMEOUT_MS', 10000),
+                    w=_write_concern(),
+                )
     return _client
 
 
 def get_db():
-    uri = getattr(settings, 'MONGO_URI', None) or os.getenv('MONGO_URI', 'mongodb://localhost:27017/gps_monitoring')
-    parsed = urlparse(uri)
-    dbname = (parsed.path or '/gps_monitoring').lstrip('/') or 'gps_monitoring'
-    return get_mongo_client()[dbname]
+    # el nombre de la base sale de la URI una sola vez
+    global _db
+    if _db is None:
+        _db = get_mongo_client().get_default_database(default='gps_monitoring')
+    return _db
+
+
+def _failed(op, collection, exc):
+    with _lock:
+        _stats['failures'] += 1
+        _stats['last_error'] = f'{op} {collection}: {exc}'[:300]
+    logger.warning('Mongo %s en %s falló: %s', op, collection, exc)
+
+
+def bulk_write(collection: str, ops: list):
+    """``bulk_write`` desordenado: un error en una operación no corta el resto.
+
+    Los errores se cuentan (``snapshot``) y se relanzan; quien no deba fallar
+    por Mongo atrapa ``PyMongoError``.
+    """
+    if not ops:
+        return None
+    with _lock:
+        _stats['ops'] += len(ops)
+    try:
+        return get_db()[collection].bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        with _lock:
+            _stats['write_errors'] += len(e.details.get('writeErrors', []))
+        _failed('bulk_write', collection, e)
+        raise
+    except PyMongoError as e:
+        _failed('bulk_write', collection, e)
+        raise
+
+
+def insert_many(collection: str, docs: list):
+    if not docs:
+        return None
+    with _lock:
+        _stats['ops'] += len(docs)
+    try:
+        return get_db()[collection].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        with _lock:
+            _stats['write_errors'] += len(e.details.get('writeErrors', []))
+        _failed('insert_many', collection, e)
+        raise
+    except PyMongoError as e:
+        _failed('insert_many', collection, e)
+        raise
+
+
+def delete_many(collection: str, query: dict) -> int:
+    try:
+        return get_db()[collection].delete_many(query).deleted_count
+    except PyMongoError as e:
+        _failed('delete_many', collection, e)
+        raise
+
 
+def snapshot() -> dict:
+    with _lock:
+        return dict(_stats)
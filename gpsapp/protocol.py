@@ -0,0 +1,185 @@
+"""Formatos compactos de ingesta: registro binario fijo y NMEA crudo.
+
+Binario (``application/octet-stream``), little-endian::
+
+    cabecera:  B versión (=1) | B largo del device_id | device_id ASCII
+    registros: I epoch (0 = hora del servidor) | i lat * 1e7 | i lng * 1e7
+               | H velocidad km/h * 100 | B CSQ | B flags (bit0 = encendido)
+
+Un fix ocupa 16 bytes más la cabecera (~27 bytes en total frente a ~150
+del JSON). Se pueden enviar varios registros seguidos en el mismo POST.
+Por TCP (``manage.py gps_listener``) cada mensaje va precedido de la
+cabecera de frame ``B 0xA5 | H largo`` little-endian; el byte mágico
+distingue el modo binario de JSON (``{``) y NMEA (``$``) sin depender del
+largo. La respuesta es un byte de flags (``encode_reply``).
+"""
+import struct
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+from .ingest import FixError
+
+
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+NMEA_CONTENT_TYPES = ('text/x-nmea',)
+
+BINARY_VERSION = 1
+FRAME_MAGIC = 0xA5
+FRAME_HEADER = struct.Struct('<BH')
+RECORD = struct.Struct('<IiiHBB')
+FLAG_VEHICLE_ON = 0x01
+REPLY_SHUTDOWN = 0x01
+REPLY_TRANSMIT_AUDIO = 0x02
+REPLY_ERROR = 0x80
+
+KNOTS_TO_KMH = 1.852
+# GGA no trae fecha: sin un RMC en el mismo envío se toma el día UTC más
+# cercano a "ahora" y se descarta si queda más viejo que esto (lote reenviado)
+GGA_MAX_AGE = timedelta(hours=1)
+# adelanto tolerado del reloj del equipo antes de pasar el GGA al día anterior
+GGA_MAX_SKEW = timedelta(minutes=5)
+
+
+def decode_binary(body: bytes):
+    """Devuelve ``(device_id, fixes)`` a partir de un cuerpo binario."""
+    buf = memoryview(body)
+    if len(buf) < 2 or buf[0] != BINARY_VERSION:
+        raise FixError('Formato binario inválido.')
+    id_len = buf[1]
+    start = 2 + id_len
+    payload = buf[start:]
+    if id_len == 0 or len(buf) < start or not payload or len(payload) % RECORD.size:
+        raise FixError('Formato binario inválido.')
+    try:
+        device_id = bytes(buf[2:start]).decode('ascii')
+    except UnicodeDecodeError:
+        raise FixError('Formato binario inválido.')
+
+    now = timezone.now()
+    fixes = []
+    for epoch, lat_e7, lng_e7, speed_c, csq, flags in RECORD.iter_unpack(payload):
+        # (0, 0) es "sin fix", igual que ingest.has_position; el ecuador y el
+        # meridiano de Greenwich solos son posiciones válidas
+        if lat_e7 == 0 and lng_e7 == 0:
+            continue
+        fixes.append({
+            'lat': lat_e7 / 1e7,
+            'lng': lng_e7 / 1e7,
+            'speed': speed_c / 100.0,
+            'signal_quality': csq,
+            'vehicle_on': bool(flags & FLAG_VEHICLE_ON),
+            'timestamp': datetime.fromtimestamp(epoch, tz=dt_timezone.utc) if epoch else now,
+        })
+    return device_id, fixes
+
+
+def encode_reply(shutdown: bool, transmit_audio: bool) -> bytes:
+    return bytes(((REPLY_SHUTDOWN if shutdown else 0) | (REPLY_TRANSMIT_AUDIO if transmit_audio else 0),))
+
+
+def _checksum_ok(sentence: str) -> bool:
+    if '*' not in sentence:
+        return True
+    body, _, given = sentence[1:].partition('*')
+    calc = 0
+    for ch in body:
+        calc ^= ord(ch)
+    try:
+        return calc == int(given[:2], 16)
+    except ValueError:
+        return False
+
+
+def _coord(value: str, hemi: str):
+    # ddmm.mmmm / dddmm.mmmm -> grados decimales
+    raw = float(value)
+    deg = int(raw // 100)
+    out = deg + (raw - deg * 100) / 60.0
+    return -out if hemi in ('S', 'W') else out
+
+
+def _utc_time(hhmmss: str, day):
+    h, m, s = int(hhmmss[0:2]), int(hhmmss[2:4]), float(hhmmss[4:])
+    return datetime(day.year, day.month, day.day, h, m, tzinfo=dt_timezone.utc) + timedelta(seconds=s)
+
+
+def _gga_time(hhmmss: str, rmc_ts, now):
+    """Hora de un GGA: el día del último RMC (corrigiendo el cruce de
+    medianoche) o, sin RMC, hoy o ayer según cuál quede más cerca de ``now``.
+    ``None`` si sin RMC queda más viejo que ``GGA_MAX_AGE``."""
+    half_day = timedelta(hours=12)
+    if rmc_ts is not None:
+        ts = _utc_time(hhmmss, rmc_ts.date())
+        if ts - rmc_ts > half_day:
+            ts -= timedelta(days=1)
+        elif rmc_ts - ts > half_day:
+            ts += timedelta(days=1)
+        return ts
+    ts = _utc_time(hhmmss, now.date())
+    if ts > now + GGA_MAX_SKEW:
+        # p.ej. un GGA de las 23:59:58 procesado pasada la medianoche
+        ts -= timedelta(days=1)
+    return ts if now - ts <= GGA_MAX_AGE else None
+
+
+def decode_nmea(text: str, signal_quality: int = 0, vehicle_on: bool = False):
+    """Parsea sentencias GGA/RMC (una por línea) y devuelve la lista de fixes.
+
+    RMC aporta fecha y velocidad; un GGA con la misma hora que un RMC ya
+    leído se descarta y uno sin RMC previo toma la fecha según ``_gga_time``.
+    Se ignoran sentencias sin fix o con checksum inválido.
+    """
+    fixes = []
+    seen = {}
+    now = timezone.now().astimezone(dt_timezone.utc)
+    today = now.date()
+    rmc_ts = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line.startswith('$') or not _checksum_ok(line):
+            continue
+        parts = line.split('*', 1)[0].split(',')
+        kind = parts[0][3:]
+        try:
+            if kind == 'RMC' and len(parts) >= 10:
+                if parts[2] != 'A' or not parts[3] or not parts[5]:
+                    continue
+                day = datetime.strptime(parts[9], '%d%m%y').date() if parts[9] else today
+                key = parts[1]
+                if parts[1] and parts[9]:
+                    rmc_ts = _utc_time(parts[1], day)
+                fix = {
+                    'lat': _coord(parts[3], parts[4]),
+                    'lng': _coord(parts[5], parts[6]),
+                    'speed': float(parts[7] or 0) * KNOTS_TO_KMH,
+                    'timestamp': _utc_time(parts[1], day) if parts[1] else timezone.now(),
+                }
+            elif kind == 'GGA' and len(parts) >= 7:
+                if parts[6] in ('', '0') or not parts[2] or not parts[4]:
+                    continue
+                key = parts[1]
+                if key in seen:
+                    continue
+                ts = _gga_time(parts[1], rmc_ts, now) if parts[1] else now
+                if ts is None:
+                    continue
+                fix = {
+                    'lat': _coord(parts[2], parts[3]),
+                    'lng': _coord(parts[4], parts[5]),
+                    'speed': 0.0,
+                    'timestamp': ts,
+                }
+            else:
+                continue
+        except (ValueError, IndexError):
+            continue
+        fix['signal_quality'] = signal_quality
+        fix['vehicle_on'] = vehicle_on
+        if key in seen:
+            # RMC después de un GGA de la misma hora: se queda el RMC (trae velocidad)
+            fixes[seen[key]] = fix
+        else:
+            seen[key] = len(fixes)
+            fixes.append(fix)
+    return fixes
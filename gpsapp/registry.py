@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .models import Vehicle
+
+
+# Lo mínimo que necesita la ingesta por cada fix: a qué vehículo va y qué
+# comandos hay que devolverle al equipo.
+DeviceEntry = namedtuple('DeviceEntry', ['id', 'user_id', 'shutdown', 'transmit_audio'])
+
+logger = logging.getLogger(__name__)
+
+# grupo del channel layer al que se suscribe cada proceso que cachea entradas
+GROUP = 'registry'
+# channels_redis expira la pertenencia a grupos (group_expiry, 1 día): se renueva
+REJOIN_INTERVAL = 3600
+
+_entries = {}      # device_id -> (DeviceEntry, cargado_en)
+_by_vehicle = {}   # vehicle_id -> device_id
+_lock = threading.Lock()
+_listener = None
+
+
+def lookup(device_id: str):
+    """Devuelve el ``DeviceEntry`` del dispositivo o ``None`` si no existe.
+
+    Las entradas se invalidan por señales al guardar/borrar un ``Vehicle``;
+    el TTL (``DEVICE_REGISTRY_TTL``) cubre los cambios hechos por otros
+    procesos o con ``QuerySet.update()``.
+    """
+    entry = _cached(device_id)
+    if entry is not None:
+        return entry
+    row = _query(device_id).first()
+    return _remember(device_id, row)
+
+
+async def alookup(device_id: str):
+    ensure_listener()
+    entry = _cached(device_id)
+    if entry is not None:
+        return entry
+    row = await _query(device_id).afirst()
+    return _remember(device_id, row)
+
+
+def _query(device_id):
+    return (Vehicle.objects.filter(device_id=device_id)
+            .values_list('id', 'user_id', 'shutdown', 'transmit_audio'))
+
+
+def _cached(device_id):
+    ttl = getattr(settings, 'DEVICE_REGISTRY_TTL', 60)
+    with _lock:
+        hit = _entries.get(device_id)
+    if hit is not None and time.monotonic() - hit[1] < ttl:
+        return hit[0]
+    return None
+
+
+def _remember(device_id, row):
+    if row is None:
+        forget_device(device_id)
+        return None
+    entry = DeviceEntry(row[0], row[1], bool(row[2]), bool(row[3]))
+    with _lock:
+        _entries[device_id] = (entry, time.monotonic())
+        _by_vehicle[entry.id] = device_id
+    return entry
+
+
+def forget_device(device_id: str):
+    with _lock:
+        hit = _entries.pop(device_id, None)
+        if hit is not None:
+            _by_vehicle.pop(hit[0].id, None)
+
+
+def forget_vehicle(vehicle_id: int):
+    with _lock:
+        device_id = _by_vehicle.pop(vehicle_id, None)
+        if device_id is not None:
+            _entries.pop(device_id, None)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _by_vehicle.clear()
+
+
+def on_vehicle_changed(sender, instance, **kwargs):
+    # cubre cambios de device_id: se borra tanto la entrada vieja como la nueva
+    forget_vehicle(instance.id)
+    if instance.device_id:
+        forget_device(instance.device_id)
+    _notify(instance.id, instance.device_id)
+
+
+def _notify(vehicle_id, device_id):
+    """Avisa al resto de los procesos (web y listener) que olviden la entrada."""
+    message = {'type': 'registry.invalidate', 'vehicle_id': vehicle_id, 'device_id': device_id or ''}
+    group_send = get_channel_layer().group_send
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    try:
+        if loop is not None:
+            loop.create_task(group_send(GROUP, message))
+        else:
+            async_to_sync(group_send)(GROUP, message)
+    except Exception:
+        logger.warning('No se pudo publicar la invalidación del vehículo %s', vehicle_id)
+
+
+def handle_invalidate(message: dict):
+    try:
+        forget_vehicle(int(message.get('vehicle_id')))
+    except (TypeError, ValueError):
+        pass
+    if message.get('device_id'):
+        forget_device(message['device_id'])
+
+
+def ensure_listener():
+    """Arranca (una vez por event loop) la suscripción a ``GROUP``."""
+    global _listener
+    loop = asyncio.get_running_loop()
+    if _listener is None or _listener.done() or _listener.get_loop() is not loop:
+        _listener = loop.create_task(_listen())
+
+
+async def _listen():
+    channel_layer = get_channel_layer()
+    channel = await channel_layer.new_channel()
+    joined = None
+    while True:
+        try:
+            if joined is None or time.monotonic() - joined > REJOIN_INTERVAL:
+                await channel_layer.group_add(GROUP, channel)
+                joined = time.monotonic()
+            message = await asyncio.wait_for(channel_layer.receive(channel), REJOIN_INTERVAL)
+        except asyncio.TimeoutError:
+            continue
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Error leyendo invalidaciones del registry')
+            await asyncio.sleep(1)
+            continue
+        if message.get('type') == 'registry.invalidate':
+            handle_invalidate(message)
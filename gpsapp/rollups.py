@@ -0,0 +1,217 @@
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import DateTimeField, F, Max, Value
+from django.db.models.functions import Coalesce, Least
+from django.utils import timezone
+
+from . import archive, history_cache
+from .geo import haversine_m
+from .models import HistoryRollup, Vehicle
+from .stores import get_store, mirror_names
+
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+ROLLUP_FIELDS = ['lat', 'lng', 'signal_quality', 'vehicle_on', 'max_speed', 'avg_speed',
+                 'distance_m', 'ignition_s', 'samples']
+
+
+def floor_dt(dt: datetime, seconds: int) -> datetime:
+    epoch = int(dt.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=dt_timezone.utc)
+
+
+def _new_bucket(bucket):
+    return {'bucket': bucket, 'max_speed': 0.0, 'speed_sum': 0.0, 'distance_m': 0.0,
+            'ignition_s': 0.0, 'samples': 0}
+
+
+def _finish(b):
+    b['avg_speed'] = b.pop('speed_sum') / b['samples'] if b['samples'] else 0.0
+    return b
+
+
+def rollup_raw(vehicle_id: int, since: datetime, until: datetime) -> list:
+    """Agrupa por minuto los puntos crudos en ``[since, until)``.
+
+    La distancia y el tiempo de ignición de cada tramo se imputan al minuto
+    del punto que lo cierra; los huecos mayores a ``HISTORY_ROLLUP_MAX_GAP``
+    no suman tiempo de ignición.
+    """
+    max_gap = getattr(settings, 'HISTORY_ROLLUP_MAX_GAP', 600)
+    # se arranca un poco antes para tener el punto previo: el tramo que entra
+    # desde el minuto anterior también cuenta
+    rows = archive.query_range(vehicle_id, since - timedelta(seconds=max_gap), until)
+    prev = None
+    out = []
+    cur = None
+    for ts, lat, lng, speed, sq, on in rows:
+        if ts >= until:
+            break
+        if ts < since:
+            prev = (ts, lat, lng, speed, sq, on)
+            continue
+        bucket = floor_dt(ts, 60)
+        if cur is None or cur['bucket'] != bucket:
+            if cur is not None:
+                out.append(_finish(cur))
+            cur = _new_bucket(bucket)
+        if prev is not None:
+            cur['distance_m'] += haversine_m(prev[1], prev[2], lat, lng)
+            dt = (ts - prev[0]).total_seconds()
+            if prev[5] and dt <= max_gap:
+                cur['ignition_s'] += dt
+        cur['lat'], cur['lng'], cur['signal_quality'], cur['vehicle_on'] = lat, lng, sq, bool(on)
+        cur['max_speed'] = max(cur['max_speed'], speed)
+        cur['speed_sum'] += speed
+        cur['samples'] += 1
+        prev = (ts, lat, lng, speed, sq, on)
+    if cur is not None:
+        out.append(_finish(cur))
+    return out
+
+
+def rollup_minutes(vehicle_id: int, since: datetime, until: datetime) -> list:
+    """Agrupa por hora los rollups de minuto en ``[since, until)``."""
+    rows = (HistoryRollup.objects
+            .filter(vehicle_id=vehicle_id, resolution=HistoryRollup.MINUTE, bucket__gte=since, bucket__lt=until)
+            .order_by('bucket')
+            .values_list('bucket', *ROLLUP_FIELDS))
+    out = []
+    cur = None
+    for bucket, lat, lng, sq, on, max_speed, avg_speed, distance, ignition, samples in rows:
+        hour = floor_dt(bucket, 3600)
+        if cur is None or cur['bucket'] != hour:
+            if cur is not None:
+                out.append(_finish(cur))
+            cur = _new_bucket(hour)
+        cur['lat'], cur['lng'], cur['signal_quality'], cur['vehicle_on'] = lat, lng, sq, on
+        cur['max_speed'] = max(cur['max_speed'], max_speed)
+        cur['speed_sum'] += avg_speed * samples
+        cur['distance_m'] += distance
+        cur['ignition_s'] += ignition
+        cur['samples'] += samples
+    if cur is not None:
+        out.append(_finish(cur))
+    return out
+
+
+def save_rollups(vehicle_id: int, resolution: str, buckets: list):
+    if not buckets:
+        return
+    HistoryRollup.objects.bulk_create(
+        [HistoryRollup(vehicle_id=vehicle_id, resolution=resolution, **b) for b in buckets],
+        update_conflicts=True,
+        unique_fields=['vehicle', 'resolution', 'bucket'],
+        update_fields=ROLLUP_FIELDS,
+    )
+
+
+def take_dirty(vehicle_id: int, field: str = 'history_dirty_from'):
+    """Lee y limpia la marca de fixes tardíos ``field`` (una de
+    ``Vehicle.DIRTY_FIELDS``). Se limpia antes de leer el crudo (y sólo si
+    nadie la bajó mientras tanto): lo que se escriba durante la corrida queda
+    marcado para la próxima."""
+    dirty = Vehicle.objects.filter(id=vehicle_id).values_list(field, flat=True).first()
+    if dirty is not None:
+        Vehicle.objects.filter(id=vehicle_id, **{field: dirty}).update(**{field: None})
+    return dirty
+
+
+def restore_dirty(vehicle_id: int, dirty: datetime, field: str = 'history_dirty_from'):
+    """Vuelve a marcar ``dirty`` si la pasada falló."""
+    if dirty is None:
+        return
+    ts = Value(dirty, output_field=DateTimeField())
+    Vehicle.objects.filter(id=vehicle_id).update(**{field: Coalesce(Least(F(field), ts), ts)})
+
+
+def run_vehicle(vehicle_id: int, now: datetime = None, dirty_from: datetime = None) -> dict:
+    """Rollup incremental de un vehículo: rehace el último minuto/hora
+    guardado (pudo quedar incompleto) y sigue hasta el último cerrado. Si
+    llegaron fixes tardíos (``dirty_from``, ver ``take_dirty``) se rehace
+    desde el minuto del más viejo."""
+    now = now or timezone.now()
+    done = {}
+    last = (HistoryRollup.objects.filter(vehicle_id=vehicle_id, resolution=HistoryRollup.MINUTE)
+            .aggregate(m=Max('bucket'))['m'])
+    if last is None:
+        first = next(iter(archive.query_range(vehicle_id, EPOCH, now)), None)
+        if first is None:
+            return done
+        last = first[0]
+    if dirty_from is not None:
+        last = min(last, dirty_from)
+    since = floor_dt(last, 60)
+    minutes = rollup_raw(vehicle_id, since, floor_dt(now, 60))
+    save_rollups(vehicle_id, HistoryRollup.MINUTE, minutes)
+    done[HistoryRollup.MINUTE] = len(minutes)
+
+    hours = rollup_minutes(vehicle_id, floor_dt(since, 3600), floor_dt(now, 3600))
+    save_rollups(vehicle_id, HistoryRollup.HOUR, hours)
+    done[HistoryRollup.HOUR] = len(hours)
+    return done
+
+
+def prune(vehicle_id: int, now: datetime = None) -> dict:
+    """Borra crudos más viejos que ``HISTORY_RAW_RETENTION_DAYS`` (sólo lo ya
+    agregado; stores y archivo) y rollups de minuto más viejos que ``HISTORY_MINUTE_RETENTION_DAYS``."""
+    now = now or timezone.now()
+    removed = {}
+    raw_days = getattr(settings, 'HISTORY_RAW_RETENTION_DAYS', 30)
+    minute_days = getattr(settings, 'HISTORY_MINUTE_RETENTION_DAYS', 180)
+    covered = (HistoryRollup.objects.filter(vehicle_id=vehicle_id, resolution=HistoryRollup.MINUTE)
+               .aggregate(m=Max('bucket'))['m'])
+    if raw_days and covered is not None:
+        cutoff = min(now - timedelta(days=raw_days), covered)
+        for store in [get_store()] + [get_store(n) for n in mirror_names()]:
+            try:
+                removed[store.name] = store.delete_before(vehicle_id, cutoff)
+            except Exception:
+                logger.warning('No se pudo podar el historial en %s', store.name)
+        removed['archive'] = archive.delete_before(vehicle_id, cutoff)
+        if any(removed.values()):
+            history_cache.invalidate_vehicle(vehicle_id)
+    if minute_days:
+        cutoff = now - timedelta(days=minute_days)
+        removed['minute'], _ = HistoryRollup.objects.filter(
+            vehicle_id=vehicle_id, resolution=HistoryRollup.MINUTE, bucket__lt=cutoff).delete()
+    return removed
+
+
+def pick_resolution(requested: str, dt_from: datetime, dt_to: datetime) -> str:
+    """``raw``/``minute``/``hour`` explícitos se respetan; ``auto`` elige según
+    el largo del rango y si el inicio ya pasó la retención de crudos."""
+    if requested in ('raw', HistoryRollup.MINUTE, HistoryRollup.HOUR):
+        return requested
+    span = dt_to - dt_from
+    raw_days = getattr(settings, 'HISTORY_RAW_RETENTION_DAYS', 30)
+    too_old = raw_days and dt_from < timezone.now() - timedelta(days=raw_days)
+    if span <= timedelta(hours=getattr(settings, 'HISTORY_RAW_MAX_SPAN_HOURS', 48)) and not too_old:
+        return 'raw'
+    if span <= timedelta(days=getattr(settings, 'HISTORY_MINUTE_MAX_SPAN_DAYS', 14)):
+        return HistoryRollup.MINUTE
+    return HistoryRollup.HOUR
+
+
+def _point(bucket, lat, lng, sq, on, max_speed, avg_speed, distance, ignition, samples):
+    return {
+        'lat': float(lat), 'lng': float(lng), 'speed': float(max_speed),
+        'signal_quality': int(sq), 'vehicle_on': bool(on),
+        'timestamp': bucket.isoformat(),
+        'avg_speed': float(avg_speed), 'distance_m': float(distance),
+        'ignition_s': float(ignition), 'samples': int(samples),
+    }
+
+
+def query_rollups(vehicle_id: int, resolution: str, dt_from: datetime, dt_to: datetime) -> list:
+    rows = (HistoryRollup.objects
+            .filter(vehicle_id=vehicle_id, resolution=resolution, bucket__gte=dt_from, bucket__lte=dt_to)
+            .order_by('bucket')
+            .values_list('bucket', *ROLLUP_FIELDS))
+    return [_point(*r) for r in rows]
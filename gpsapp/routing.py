@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/vehicle/(?P<vehicle_id>\d+)/$', consumers.VehicleConsumer.as_asgi()),
+    re_path(r'ws/fleet/$', consumers.FleetConsumer.as_asgi()),
 ]
@@ -0,0 +1,99 @@
+"""Simplificación de recorridos (Douglas–Peucker) para dibujar en el mapa.
+
+Se trabaja sobre columnas NumPy proyectadas a metros (equirectangular local,
+suficiente a escala de un recorrido). Los puntos donde arranca o termina una
+detención y los cambios de ignición se conservan siempre.
+"""
+import numpy as np
+
+from .geo import EARTH_RADIUS_M, segment_distances_m
+
+# por debajo de esta velocidad (km/h) el vehículo se considera detenido
+STOP_SPEED_KMH = 1.0
+# metros por píxel en el ecuador a zoom 0 (tiles de 256 px)
+METERS_PER_PIXEL_Z0 = 156543.03392
+# zoom máximo de los tiles que usa el mapa
+MAX_ZOOM = 22
+
+
+def zoom_tolerance_m(zoom: float, lat: float) -> float:
+    """Tolerancia de un píxel al zoom dado (Leaflet / OSM)."""
+    return METERS_PER_PIXEL_Z0 * np.cos(np.radians(lat)) / 2 ** zoom
+
+
+def _project(lat, lng):
+    k = np.pi / 180 * EARTH_RADIUS_M
+    return lng * np.cos(np.radians(lat.mean())) * k, lat * k
+
+
+def forced_points(speed, vehicle_on) -> np.ndarray:
+    """Bordes de las detenciones y de los cambios de ignición (ambos lados)."""
+    keep = np.zeros(len(speed), dtype=bool)
+    if len(speed) < 2:
+        keep[:] = True
+        return keep
+    stopped = speed < STOP_SPEED_KMH
+    edges = np.flatnonzero((stopped[1:] != stopped[:-1]) | (vehicle_on[1:] != vehicle_on[:-1]))
+    keep[edges] = True
+    keep[edges + 1] = True
+    keep[0] = keep[-1] = True
+    return keep
+
+
+def douglas_peucker(x, y, tolerance: float, keep=None) -> np.ndarray:
+    """Máscara de puntos a conservar. ``keep`` son puntos obligatorios: el
+    recorrido se parte en ellos y cada tramo se simplifica por separado."""
+    n = len(x)
+    keep = np.zeros(n, dtype=bool) if keep is None else keep.copy()
+    if n < 3:
+        keep[:] = True
+        return keep
+    keep[0] = keep[-1] = True
+    anchors = np.flatnonzero(keep)
+    stack = [(a, b) for a, b in zip(anchors[:-1], anchors[1:]) if b - a > 1]
+    while stack:
+        a, b = stack.pop()
+        px, py = x[a + 1:b], y[a + 1:b]
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        seg2 = dx * dx + dy * dy
+        if seg2 == 0:
+            d = np.hypot(px - x[a], py - y[a])
+        else:
+            # distancia al segmento (no a la recta): los recorridos van y vuelven
+            t = np.clip(((px - x[a]) * dx + (py - y[a]) * dy) / seg2, 0.0, 1.0)
+            d = np.hypot(px - (x[a] + t * dx), py - (y[a] + t * dy))
+        i = int(d.argmax())
+        if d[i] > tolerance:
+            m = a + 1 + i
+            keep[m] = True
+            if m - a > 1:
+                stack.append((a, m))
+            if b - m > 1:
+                stack.append((m, b))
+    return keep
+
+
+def simplify_track(lat, lng, speed, vehicle_on, tolerance: float) -> np.ndarray:
+    lat = np.asarray(lat, dtype=float)
+    lng = np.asarray(lng, dtype=float)
+    if len(lat) < 3:
+        return np.ones(len(lat), dtype=bool)
+    x, y = _project(lat, lng)
+    forced = forced_points(np.asarray(speed, dtype=float), np.asarray(vehicle_on, dtype=bool))
+    return douglas_peucker(x, y, tolerance, forced)
+
+
+def simplify_rows(rows, tolerance: float = None, zoom: float = None):
+    """Simplifica filas ``stores.FIELDS``. Devuelve ``(filas, cantidad
+    original, distancia en metros)``; la distancia sale de todos los puntos."""
+    cols = list(zip(*rows))
+    if not cols:
+        return [], 0, 0.0
+    ts, lat, lng, speed, sq, on = cols
+    lat_a, lng_a = np.array(lat, dtype=float), np.array(lng, dtype=float)
+    distance = float(segment_distances_m(lat_a, lng_a).sum()) if len(lat_a) > 1 else 0.0
+    if tolerance is None:
+        tolerance = zoom_tolerance_m(zoom, float(lat_a.mean()))
+    mask = simplify_track(lat_a, lng_a, speed, on, tolerance)
+    kept = ((ts[i], lat[i], lng[i], speed[i], sq[i], on[i]) for i in np.flatnonzero(mask).tolist())
+    return kept, len(ts), distance
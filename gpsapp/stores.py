@@ -0,0 +1,296 @@
+import csv
+import os
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+
+from .models import LocationHistory
+from . import mongo
+
+
+# Una fila de historial, en todos los backends:
+# (timestamp aware, lat, lng, speed, signal_quality, vehicle_on)
+FIELDS = ('timestamp', 'lat', 'lng', 'speed', 'signal_quality', 'vehicle_on')
+
+
+class HistoryStore:
+    """Backend de historial de posiciones.
+
+    ``append_many`` recibe ``(vehicle_id, fix)`` ya validados (ver
+    ``ingest.parse_fix``); ``query_range`` devuelve filas ``FIELDS`` en orden
+    de timestamp, ambos extremos inclusive. Los empates de timestamp salen
+    siempre en el mismo orden (lo necesita la paginación, ver ``page``).
+    """
+    name = ''
+
+    def append_many(self, rows: list):
+        raise NotImplementedError
+
+    def query_range(self, vehicle_id: int, dt_from: datetime, dt_to: datetime):
+        raise NotImplementedError
+
+    def delete_before(self, vehicle_id: int, cutoff: datetime) -> int:
+        raise NotImplementedError
+
+    def delete_at(self, vehicle_id: int, timestamps: list) -> int:
+        """Borra las filas con exactamente esos timestamps (lo ya archivado)."""
+        raise NotImplementedError
+
+    def query_many(self, vehicle_ids: list, dt_from: datetime, dt_to: datetime):
+        """Filas ``(vehicle_id, *FIELDS)`` de varios vehículos, agrupadas por
+        vehículo y en orden de timestamp dentro de cada uno."""
+        for vid in sorted(vehicle_ids):
+            for row in self.query_range(vid, dt_from, dt_to):
+                yield (vid,) + tuple(row)
+
+
+class SQLiteHistoryStore(HistoryStore):
+    name = 'sqlite'
+
+    def append_many(self, rows):
+        LocationHistory.objects.bulk_create([
+            LocationHistory(
+                vehicle_id=vid, lat=f['lat'], lng=f['lng'], speed=f['speed'],
+                signal_quality=f['signal_quality'], vehicle_on=f['vehicle_on'],
+                timestamp=f['timestamp'],
+            )
+            for vid, f in rows
+        ])
+
+    def query_range(self, vehicle_id, dt_from, dt_to):
+        return (LocationHistory.objects
+                .filter(vehicle_id=vehicle_id, timestamp__gte=dt_from, timestamp__lte=dt_to)
+                .order_by('timestamp', 'id')
+                .values_list(*FIELDS)
+                .iterator(chunk_size=2000))
+
+    def query_many(self, vehicle_ids, dt_from, dt_to):
+        # un solo IN; el índice (vehicle, timestamp) sirve para cada vehículo
+        return (LocationHistory.objects
+                .filter(vehicle_id__in=list(vehicle_ids), timestamp__gte=dt_from, timestamp__lte=dt_to)
+                .order_by('vehicle_id', 'timestamp', 'id')
+                .values_list('vehicle_id', *FIELDS)
+                .iterator(chunk_size=2000))
+
+    def delete_before(self, vehicle_id, cutoff):
+        deleted, _ = LocationHistory.objects.filter(vehicle_id=vehicle_id, timestamp__lt=cutoff).delete()
+        return deleted
+
+    def delete_at(self, vehicle_id, timestamps):
+        deleted = 0
+        # de a tandas: SQLite limita las variables por consulta
+        for i in range(0, len(timestamps), 500):
+            n, _ = LocationHistory.objects.filter(
+                vehicle_id=vehicle_id, timestamp__in=timestamps[i:i + 500]).delete()
+            deleted += n
+        return deleted
+
+
+class MongoHistoryStore(HistoryStore):
+    name = 'mongo'
+
+    def append_many(self, rows):
+        mongo.insert_many('location_history', [
+            {
+                'vehicle_id': vid,
+                'lat': f['lat'],
+                'lng': f['lng'],
+                'speed': f['speed'],
+                'signal_quality': f['signal_quality'],
+                'vehicle_on': f['vehicle_on'],
+                'timestamp': f['timestamp'],
+            }
+            for vid, f in rows
+        ])
+
+    PROJECTION = {'_id': 0, 'vehicle_id': 1, 'timestamp': 1, 'lat': 1, 'lng': 1, 'speed': 1,
+                  'signal_quality': 1, 'vehicle_on': 1}
+
+    @staticmethod
+    def _row(doc):
+        # pymongo devuelve datetimes naive en UTC
+        return (doc['timestamp'].replace(tzinfo=dt_timezone.utc), float(doc.get('lat', 0)), float(doc.get('lng', 0)),
+                float(doc.get('speed', 0)), int(doc.get('signal_quality', 0)), bool(doc.get('vehicle_on', False)))
+
+    def query_range(self, vehicle_id, dt_from, dt_to):
+        cur = mongo.get_db().location_history.find(
+            {'vehicle_id': vehicle_id, 'timestamp': {'$gte': dt_from, '$lte': dt_to}}, self.PROJECTION,
+        ).sort([('timestamp', 1), ('_id', 1)]).batch_size(2000)
+        for doc in cur:
+            if doc.get('timestamp') is None:
+                continue
+            yield self._row(doc)
+
+    def query_many(self, vehicle_ids, dt_from, dt_to):
+        cur = mongo.get_db().location_history.find(
+            {'vehicle_id': {'$in': list(vehicle_ids)}, 'timestamp': {'$gte': dt_from, '$lte': dt_to}}, self.PROJECTION,
+        ).sort([('vehicle_id', 1), ('timestamp', 1), ('_id', 1)]).batch_size(2000)
+        for doc in cur:
+            if doc.get('timestamp') is None:
+                continue
+            yield (doc['vehicle_id'],) + self._row(doc)
+
+    def delete_before(self, vehicle_id, cutoff):
+        return mongo.delete_many('location_history', {'vehicle_id': vehicle_id, 'timestamp': {'$lt': cutoff}})
+
+    def delete_at(self, vehicle_id, timestamps):
+        # BSON guarda milisegundos y trunca igual al consultar
+        deleted = 0
+        for i in range(0, len(timestamps), 5000):
+            deleted += mongo.delete_many('location_history', {
+                'vehicle_id': vehicle_id, 'timestamp': {'$in': timestamps[i:i + 5000]}})
+        return deleted
+
+
+class FileHistoryStore(HistoryStore):
+    """Un CSV por vehículo y día UTC: ``<HISTORY_FILE_DIR>/<vehicle_id>/<YYYY-MM-DD>.csv``."""
+    name = 'file'
+
+    def __init__(self, root=None):
+        self.root = Path(root or getattr(settings, 'HISTORY_FILE_DIR', 'history_data'))
+        self._lock = threading.Lock()
+
+    def _path(self, vehicle_id, day):
+        return self.root / str(vehicle_id) / f'{day.isoformat()}.csv'
+
+    def append_many(self, rows):
+        grouped = {}
+        for vid, f in rows:
+            day = f['timestamp'].astimezone(dt_timezone.utc).date()
+            grouped.setdefault((vid, day), []).append(f)
+        with self._lock:
+            for (vid, day), fixes in grouped.items():
+                path = self._path(vid, day)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, 'a', newline='') as fh:
+                    w = csv.writer(fh)
+                    for f in fixes:
+                        w.writerow([f"{f['timestamp'].timestamp():.3f}", f['lat'], f['lng'], f['speed'],
+                                    f['signal_quality'], int(f['vehicle_on'])])
+
+    def query_range(self, vehicle_id, dt_from, dt_to):
+        day = dt_from.astimezone(dt_timezone.utc).date()
+        last_day = dt_to.astimezone(dt_timezone.utc).date()
+        lo, hi = dt_from.timestamp(), dt_to.timestamp()
+        while day <= last_day:
+            path = self._path(vehicle_id, day)
+            day += timedelta(days=1)
+            if not path.exists():
+                continue
+            with open(path, newline='') as fh:
+                rows = [r for r in csv.reader(fh) if r and lo <= float(r[0]) <= hi]
+            # los lotes pueden llegar desordenados (store-and-forward)
+            rows.sort(key=lambda r: float(r[0]))
+            for epoch, lat, lng, speed, sq, on in rows:
+                yield (datetime.fromtimestamp(float(epoch), tz=dt_timezone.utc), float(lat), float(lng),
+                       float(speed), int(sq), on == '1')
+
+    def delete_before(self, vehicle_id, cutoff):
+        # sólo días completos anteriores al corte
+        cutoff_day = cutoff.astimezone(dt_timezone.utc).date().isoformat()
+        folder = self.root / str(vehicle_id)
+        removed = 0
+        if folder.exists():
+            for path in folder.glob('*.csv'):
+                if path.stem < cutoff_day:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def delete_at(self, vehicle_id, timestamps):
+        per_day = {}
+        for ts in timestamps:
+            per_day.setdefault(ts.astimezone(dt_timezone.utc).date(), set()).add(f'{ts.timestamp():.3f}')
+        removed = 0
+        with self._lock:
+            for day, stamps in per_day.items():
+                path = self._path(vehicle_id, day)
+                if not path.exists():
+                    continue
+                with open(path, newline='') as fh:
+                    rows = [r for r in csv.reader(fh) if r]
+                keep = [r for r in rows if r[0] not in stamps]
+                removed += len(rows) - len(keep)
+                if not keep:
+                    os.remove(path)
+                    continue
+                tmp = path.with_suffix('.tmp')
+                with open(tmp, 'w', newline='') as fh:
+                    csv.writer(fh).writerows(keep)
+                os.replace(tmp, path)
+        return removed
+
+
+STORES = {
+    SQLiteHistoryStore.name: SQLiteHistoryStore,
+    MongoHistoryStore.name: MongoHistoryStore,
+    FileHistoryStore.name: FileHistoryStore,
+}
+_instances = {}
+
+
+def get_store(name: str = None) -> HistoryStore:
+    """Store por nombre; sin nombre (o desconocido) devuelve el primario
+    configurado en ``HISTORY_STORE``."""
+    if name not in STORES:
+        name = getattr(settings, 'HISTORY_STORE', 'sqlite')
+    if name not in _instances:
+        _instances[name] = STORES[name]()
+    return _instances[name]
+
+
+def mirror_names() -> list:
+    primary = get_store().name
+    return [n for n in getattr(settings, 'HISTORY_MIRRORS', []) if n in STORES and n != primary]
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_cursor(ts: datetime, ties: int) -> str:
+    return f'{(ts - EPOCH) // timedelta(microseconds=1)}_{ties}'
+
+
+def decode_cursor(cursor: str):
+    """``(timestamp, ties)``; lanza ``ValueError`` si el cursor no es válido."""
+    us, _, ties = cursor.partition('_')
+    ties = int(ties or 0)
+    if ties < 0:
+        raise ValueError(cursor)
+    try:
+        return EPOCH + timedelta(microseconds=int(us)), ties
+    except OverflowError:
+        raise ValueError(cursor)
+
+
+def page(rows, limit: int, after=None):
+    """Paginación keyset sobre filas ordenadas por timestamp.
+
+    El cursor es ``(timestamp, ties)``: el último timestamp devuelto y
+    cuántas filas con ese mismo timestamp ya salieron. Las filas deben venir
+    de una consulta ``timestamp >= cursor`` (que usa el índice); acá se
+    saltean los empates ya entregados. Devuelve ``(filas, siguiente cursor o
+    None)``.
+    """
+    rows = iter(rows)
+    out = []
+    if after is not None:
+        after_ts, skip = after
+        for row in rows:
+            if row[0] == after_ts and skip:
+                skip -= 1
+                continue
+            out.append(row)
+            break
+    out.extend(islice(rows, limit + 1 - len(out)))
+    if len(out) <= limit:
+        return out, None
+    out = out[:limit]
+    last = out[-1][0]
+    ties = sum(1 for r in out if r[0] == last)
+    if after is not None and last == after[0]:
+        ties += after[1]
+    return out, encode_cursor(last, ties)
@@ -0,0 +1,68 @@
+"""Respuestas en streaming para exportes grandes de historial.
+
+Los generadores producen bytes a medida que leen del store, así la memoria
+queda constante y el primer byte sale enseguida. Bajo ASGI el generador
+sync se consume de a pedazos en el hilo sync de Django (el mismo donde vive
+la conexión/cursor); entregárselo tal cual a ``StreamingHttpResponse`` haría
+que Django lo junte entero en una lista antes de enviar.
+"""
+import csv
+import json
+from io import StringIO
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+
+CHUNK_POINTS = 500
+CSV_HEADER = ['timestamp', 'lat', 'lng', 'speed', 'signal_quality', 'vehicle_on']
+
+
+def json_chunks(head: dict, key: str, items):
+    """``{...head, key: [items...]}`` en pedazos de ``CHUNK_POINTS`` elementos."""
+    yield (json.dumps(head)[:-1] + f', "{key}": [').encode('utf-8')
+    items = iter(items)
+    sep = ''
+    while True:
+        chunk = list(islice(items, CHUNK_POINTS))
+        if not chunk:
+            break
+        yield (sep + json.dumps(chunk)[1:-1]).encode('utf-8')
+        sep = ', '
+    yield b']}'
+
+
+def csv_chunks(points):
+    sio = StringIO()
+    w = csv.writer(sio)
+    w.writerow(CSV_HEADER)
+    points = iter(points)
+    while True:
+        for p in islice(points, CHUNK_POINTS):
+            w.writerow([p['timestamp'], p['lat'], p['lng'], p['speed'], p['signal_quality'], int(p['vehicle_on'])])
+        data = sio.getvalue()
+        if not data:
+            break
+        yield data.encode('utf-8')
+        sio.seek(0)
+        sio.truncate()
+
+
+def _next_chunk(it):
+    return next(it, None)
+
+
+async def _aiter(chunks):
+    it = iter(chunks)
+    while True:
+        part = await sync_to_async(_next_chunk)(it)
+        if part is None:
+            break
+        yield part
+
+
+def stream(request, chunks, content_type: str) -> StreamingHttpResponse:
+    content = _aiter(chunks) if isinstance(request, ASGIRequest) else chunks
+    return StreamingHttpResponse(content, content_type=content_type)
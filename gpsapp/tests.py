@@ -0,0 +1,376 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import tempfile
+
+import numpy as np
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import archive, broadcaster, encoding, history_cache, ingest, live, rollups, simplify, stores
+from .models import HistoryRollup, LocationHistory, User, Vehicle
+
+
+def _decode_polyline(text: str, precision: int = 5):
+    values, shift, acc = [], 0, 0
+    for ch in text.encode('ascii'):
+        b = ch - 63
+        acc |= (b & 0x1F) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(acc >> 1) if acc & 1 else acc >> 1)
+            shift, acc = 0, 0
+    coords = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return coords[:, 0].tolist(), coords[:, 1].tolist()
+
+
+class DouglasPeuckerTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        # recorrido ondulado de ~2 km con ruido
+        t = np.linspace(0, 1, 400)
+        self.lat = -34.6 + 0.01 * t + 0.0005 * np.sin(t * 40) + rng.normal(0, 2e-5, len(t))
+        self.lng = -58.4 + 0.015 * t + rng.normal(0, 2e-5, len(t))
+        self.x, self.y = simplify._project(self.lat, self.lng)
+
+    def test_keeps_endpoints(self):
+        for tolerance in (0.5, 5.0, 50.0, 5000.0):
+            keep = simplify.douglas_peucker(self.x, self.y, tolerance)
+            self.assertTrue(keep[0] and keep[-1])
+        keep = simplify.douglas_peucker(self.x, self.y, 1e9)
+        self.assertEqual(keep.sum(), 2)
+
+    def test_larger_tolerance_keeps_a_subset(self):
+        previous = None
+        for tolerance in (0.1, 1.0, 5.0, 20.0, 100.0):
+            keep = simplify.douglas_peucker(self.x, self.y, tolerance)
+            if previous is not None:
+                self.assertLessEqual(keep.sum(), previous.sum())
+                self.assertFalse((keep & ~previous).any())
+            previous = keep
+
+    def test_points_within_tolerance_of_the_result(self):
+        tolerance = 10.0
+        keep = simplify.douglas_peucker(self.x, self.y, tolerance)
+        idx = np.flatnonzero(keep)
+        for a, b in zip(idx[:-1], idx[1:]):
+            px, py = self.x[a:b + 1], self.y[a:b + 1]
+            dx, dy = self.x[b] - self.x[a], self.y[b] - self.y[a]
+            t = np.clip(((px - self.x[a]) * dx + (py - self.y[a]) * dy) / (dx * dx + dy * dy), 0, 1)
+            d = np.hypot(px - (self.x[a] + t * dx), py - (self.y[a] + t * dy))
+            self.assertLessEqual(d.max(), tolerance + 1e-9)
+
+    def test_degenerate_inputs(self):
+        for n in (0, 1, 2):
+            x = np.arange(n, dtype=float)
+            keep = simplify.douglas_peucker(x, x, 1.0)
+            self.assertEqual(len(keep), n)
+            self.assertTrue(keep.all())
+            self.assertEqual(len(simplify.simplify_track(x, x, np.zeros(n), np.zeros(n, bool), 1.0)), n)
+        self.assertEqual(simplify.simplify_rows([], tolerance=1.0), ([], 0, 0.0))
+
+    def test_duplicate_points(self):
+        x = np.full(10, 3.0)
+        keep = simplify.douglas_peucker(x, x.copy(), 1.0)
+        self.assertEqual(np.flatnonzero(keep).tolist(), [0, 9])
+        # vuelta al punto de partida: el segmento de extremos tiene largo cero
+        x = np.array([0.0, 10.0, 20.0, 10.0, 0.0])
+        keep = simplify.douglas_peucker(x, np.zeros(5), 1.0)
+        self.assertTrue(keep[2])
+
+    def test_stop_edges_are_forced(self):
+        speed = np.full(len(self.lat), 40.0)
+        speed[100:150] = 0.0
+        on = np.ones(len(self.lat), bool)
+        on[300:] = False
+        keep = simplify.simplify_track(self.lat, self.lng, speed, on, 1e9)
+        for i in (99, 100, 149, 150, 299, 300):
+            self.assertTrue(keep[i], i)
+
+
+class EncodingTests(SimpleTestCase):
+    def _rows(self, n=50):
+        t0 = datetime(2026, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc)
+        rng = np.random.default_rng(3)
+        lat = -34.6 + np.cumsum(rng.normal(0, 1e-4, n))
+        lng = -58.4 + np.cumsum(rng.normal(0, 1e-4, n))
+        return [(t0 + timedelta(seconds=7 * i), float(lat[i]), float(lng[i]), float(i % 60), i % 31, i % 3 == 0)
+                for i in range(n)]
+
+    def test_polyline_reference_vector(self):
+        # ejemplo de la documentación de Google
+        self.assertEqual(encoding.encode_polyline([38.5, 40.7, 43.252], [-120.2, -120.95, -126.453]),
+                         '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(encoding.encode_polyline([], []), '')
+
+    def test_polyline_round_trip(self):
+        rows = self._rows()
+        out = encoding.polyline(rows)
+        lat, lng = _decode_polyline(out['polyline'])
+        self.assertEqual(out['count'], len(rows))
+        np.testing.assert_allclose(lat, [r[1] for r in rows], atol=1e-5)
+        np.testing.assert_allclose(lng, [r[2] for r in rows], atol=1e-5)
+        self.assertEqual(np.cumsum(out['timestamp']).tolist(), [int(r[0].timestamp()) for r in rows])
+        self.assertEqual(np.cumsum(out['vehicle_on']).astype(bool).tolist(), [r[5] for r in rows])
+
+    def test_columnar_round_trip(self):
+        rows = self._rows()
+        out = encoding.columnar(rows)
+        self.assertEqual(out['count'], len(rows))
+        ts = np.cumsum(out['timestamp']).tolist()
+        back = [(datetime.fromtimestamp(t, tz=dt_timezone.utc), la, ln, sp, sq, bool(on))
+                for t, la, ln, sp, sq, on in zip(ts, out['lat'], out['lng'], out['speed'],
+                                                 out['signal_quality'], out['vehicle_on'])]
+        for got, want in zip(back, rows):
+            self.assertEqual(got[0], want[0])
+            self.assertAlmostEqual(got[1], want[1], places=6)
+            self.assertAlmostEqual(got[2], want[2], places=6)
+            self.assertEqual(got[3:], want[3:])
+        self.assertEqual(encoding.columnar([])['count'], 0)
+
+
+class CursorPageTests(SimpleTestCase):
+    def _rows(self):
+        t0 = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        # grupos de empates de distinto largo, varios más largos que una página
+        rows = []
+        for i, n in enumerate((1, 3, 7, 2, 12, 1, 5)):
+            rows += [(t0 + timedelta(seconds=i), float(i), float(j), 0.0, 0, True) for j in range(n)]
+        return rows
+
+    def _all_pages(self, rows, limit):
+        out, cursor, pages = [], None, 0
+        while True:
+            after = stores.decode_cursor(cursor) if cursor else None
+            # como la vista: la consulta arranca en el timestamp del cursor
+            source = [r for r in rows if after is None or r[0] >= after[0]]
+            got, cursor = stores.page(source, limit, after)
+            out += got
+            pages += 1
+            if cursor is None:
+                return out, pages
+
+    def test_ties_across_page_boundaries(self):
+        rows = self._rows()
+        for limit in (1, 2, 3, 4, 5, 8, len(rows) - 1, len(rows), len(rows) + 1):
+            got, pages = self._all_pages(rows, limit)
+            self.assertEqual(got, rows, limit)
+            self.assertEqual(pages, max(1, -(-len(rows) // limit)), limit)
+
+    def test_cursor_round_trip(self):
+        ts = datetime(2026, 5, 6, 7, 8, 9, 123456, tzinfo=dt_timezone.utc)
+        self.assertEqual(stores.decode_cursor(stores.encode_cursor(ts, 4)), (ts, 4))
+
+    def test_invalid_cursors(self):
+        for cursor in ('abc', '12_x', '_3', '1.5_0', '5_-1', '9' * 30 + '_0'):
+            with self.assertRaises(ValueError, msg=cursor):
+                stores.decode_cursor(cursor)
+
+
+@override_settings(HISTORY_STORE='sqlite', HISTORY_MIRRORS=[], HISTORY_ARCHIVE_DIR=tempfile.mkdtemp())
+class HistoryPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('u', 'u@example.com', 'secreto')
+        cls.vehicle = Vehicle.objects.create(user=cls.user, name='a', type='auto', patente='AAA111')
+        cls.t0 = timezone.now().replace(microsecond=0) - timedelta(hours=2)
+        rows = []
+        for i in range(40):
+            # de a tres con el mismo timestamp
+            ts = cls.t0 + timedelta(seconds=10 * (i // 3))
+            rows.append(LocationHistory(vehicle=cls.vehicle, lat=-34 - i * 1e-4, lng=-58, speed=i,
+                                        signal_quality=9, vehicle_on=True, timestamp=ts))
+        LocationHistory.objects.bulk_create(rows)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _get(self, **params):
+        fmt = '%Y-%m-%dT%H:%M'
+        params = {'resolution': 'raw',
+                  'from': timezone.localtime(self.t0 - timedelta(minutes=1)).strftime(fmt),
+                  'to': timezone.localtime(self.t0 + timedelta(hours=1)).strftime(fmt), **params}
+        r = self.client.get(f'/api/vehicle/{self.vehicle.id}/history', params)
+        body = b''.join(r.streaming_content) if r.streaming else r.content
+        return r.status_code, json.loads(body)
+
+    def test_pages_add_up_to_the_unpaginated_result(self):
+        _, full = self._get()
+        self.assertEqual(len(full['points']), 40)
+        for limit in (1, 4, 7, 40, 100):
+            points, cursor = [], None
+            while True:
+                status, data = self._get(limit=limit, **({'cursor': cursor} if cursor else {}))
+                self.assertEqual(status, 200)
+                points += data['points']
+                cursor = data.get('next')
+                if not cursor:
+                    break
+            self.assertEqual(points, full['points'], limit)
+
+    def test_tampered_cursor_is_rejected(self):
+        for cursor in ('garbage', '123_abc', '1_-3', '9' * 30 + '_0'):
+            status, data = self._get(limit=5, cursor=cursor)
+            self.assertEqual(status, 400, cursor)
+            self.assertEqual(data['status'], 'error')
+        status, _ = self._get(limit=0)
+        self.assertEqual(status, 400)
+
+
+@override_settings(HISTORY_STORE='sqlite', HISTORY_MIRRORS=[], HISTORY_CACHE_BUCKET=3600)
+class HistoryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+        override = override_settings(HISTORY_ARCHIVE_DIR=self.archive_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        user = User.objects.create_user('u', 'u@example.com', 'secreto')
+        # last_fix_ts al día: los fixes tardíos del test no mueven la posición
+        self.vehicle = Vehicle.objects.create(user=user, name='a', type='auto', patente='AAA111',
+                                              last_fix_ts=timezone.now())
+        # en el pasado: todos los baldes están cerrados
+        self.t0 = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        LocationHistory.objects.bulk_create([
+            LocationHistory(vehicle=self.vehicle, lat=-34, lng=-58, speed=i % 50, signal_quality=9,
+                            vehicle_on=True, timestamp=self.t0 + timedelta(seconds=10 * i))
+            for i in range(1000)])
+        self.store = stores.get_store()
+        self.dt_from = self.t0 + timedelta(minutes=20)
+        self.dt_to = self.t0 + timedelta(hours=3)
+
+    def _cached(self):
+        return list(history_cache.query_range(self.vehicle.id, self.dt_from, self.dt_to, self.store))
+
+    def _direct(self):
+        return list(archive.query_range(self.vehicle.id, self.dt_from, self.dt_to, self.store))
+
+    def _late_fix(self, ts):
+        return {'timestamp': ts, 'lat': -1.0, 'lng': -1.0, 'speed': 1.0,
+                'signal_quality': 9, 'vehicle_on': True}
+
+    def test_cached_read_matches_direct_read(self):
+        direct = self._direct()
+        self.assertTrue(direct)
+        before = history_cache.snapshot()
+        self.assertEqual(self._cached(), direct)
+        self.assertEqual(self._cached(), direct)
+        after = history_cache.snapshot()
+        self.assertEqual(after['hits'] - before['hits'], 4)
+
+    def test_late_fix_into_closed_bucket_is_visible(self):
+        self._cached()
+        late = self._late_fix(self.t0 + timedelta(minutes=30, seconds=5))
+        ingest.write_batch([(self.vehicle.id, late, '2026-01-01 00:30:05')])
+        rows = self._cached()
+        self.assertEqual(rows, self._direct())
+        self.assertIn(late['timestamp'], [r[0] for r in rows])
+
+    def test_fill_that_loses_race_to_invalidation_is_not_served(self):
+        reading = history_cache.query_range(self.vehicle.id, self.dt_from, self.dt_to, self.store)
+        next(reading)
+        # llega un fix tardío a un balde que el llenado ya leyó
+        late = self._late_fix(self.t0 + timedelta(minutes=25, seconds=5))
+        ingest.write_batch([(self.vehicle.id, late, '2026-01-01 00:25:05')])
+        list(reading)
+        rows = self._cached()
+        self.assertEqual(rows, self._direct())
+        self.assertIn(late['timestamp'], [r[0] for r in rows])
+
+    def test_archive_bumps_generation(self):
+        direct = self._direct()
+        self._cached()
+        before = history_cache.snapshot()
+        self.assertTrue(archive.archive_vehicle(self.vehicle.id, self.t0 + timedelta(days=1)))
+        self.assertFalse(LocationHistory.objects.filter(vehicle=self.vehicle).exists())
+        self.assertEqual(self._cached(), direct)
+        self.assertEqual(history_cache.snapshot()['misses'] - before['misses'], 4)
+
+    def test_prune_bumps_generation(self):
+        self._cached()
+        HistoryRollup.objects.create(vehicle=self.vehicle, resolution=HistoryRollup.MINUTE,
+                                     bucket=self.t0 + timedelta(hours=1), lat=-34, lng=-58)
+        with override_settings(HISTORY_RAW_RETENTION_DAYS=1):
+            removed = rollups.prune(self.vehicle.id, now=self.t0 + timedelta(days=5))
+        self.assertTrue(removed['sqlite'])
+        rows = self._cached()
+        self.assertEqual(rows, self._direct())
+        self.assertTrue(all(r[0] >= self.t0 + timedelta(hours=1) for r in rows))
+
+
+class FleetHistoryTests(TestCase):
+    def test_position_comes_from_live_state(self):
+        user = User.objects.create_user('u', 'u@example.com', 'secreto')
+        vehicle = Vehicle.objects.create(user=user, name='a', type='auto', patente='AAA111', lat=-34, lng=-58)
+        live.update(vehicle.id, {'lat': -35.5, 'lng': -59.5, 'speed': 42.0, 'shutdown': True})
+        self.addCleanup(live.on_vehicle_deleted, Vehicle, vehicle)
+        self.client.force_login(user)
+        data = self.client.get('/api/fleet/history', {'vehicles': str(vehicle.id)}).json()
+        position = data['vehicles'][str(vehicle.id)]['position']
+        self.assertEqual((position['lat'], position['lng'], position['speed']), (-35.5, -59.5, 42.0))
+        self.assertNotIn('shutdown', position)
+
+
+class BroadcasterPruneTests(TestCase):
+    def _payload(self, vehicle_id):
+        return {'vehicle_id': vehicle_id, 'lat': -34.0, 'lng': -58.0, 'speed': 10.0}
+
+    async def test_stale_entries_are_dropped_after_keyframe(self):
+        b = broadcaster.Broadcaster(tick=0, keyframe=30)
+        await b.publish(1, self._payload(1))
+        await b.publish(2, self._payload(2))
+        self.assertEqual(set(b.sent), {1, 2})
+        # el 1 no volvió a transmitir desde hace más de un keyframe
+        past = time.monotonic() - 60
+        b.sent[1] = (b.sent[1][0], past)
+        b.pruned_at = past
+        await b.publish(2, self._payload(2))
+        self.assertEqual(set(b.sent), {2})
+        self.assertEqual(b.snapshot()['tracked'], 1)
+
+    def test_entry_is_dropped_when_vehicle_is_deleted(self):
+        user = User.objects.create_user('u', 'u@example.com', 'secreto')
+        vehicle = Vehicle.objects.create(user=user, name='a', type='auto', patente='AAA111')
+        b = broadcaster.get_broadcaster()
+        b.sent[vehicle.id] = (self._payload(vehicle.id), time.monotonic())
+        b.pending[vehicle.id] = (user.id, self._payload(vehicle.id))
+        vehicle.delete()
+        self.assertNotIn(vehicle.id, b.sent)
+        self.assertNotIn(vehicle.id, b.pending)
+
+
+class OutOfOrderFixTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('u', 'u@example.com', 'secreto')
+        self.vehicle = Vehicle.objects.create(user=user, name='a', type='auto', patente='AAA111')
+        self.addCleanup(live.on_vehicle_deleted, Vehicle, self.vehicle)
+        self.t0 = datetime(2026, 1, 1, 12, tzinfo=dt_timezone.utc)
+
+    def _payload(self, seconds, lat):
+        fix = {'timestamp': self.t0 + timedelta(seconds=seconds), 'lat': lat, 'lng': -58.0,
+               'speed': 10.0, 'signal_quality': 9, 'vehicle_on': True}
+        return ingest.live_payload(self.vehicle, fix, '01-01-2026 09:00')
+
+    def test_live_state_ignores_older_fix(self):
+        self.assertTrue(live.update(self.vehicle.id, self._payload(10, -34.0)))
+        self.assertFalse(live.update(self.vehicle.id, self._payload(5, -35.0)))
+        self.assertEqual(live.get_many([self.vehicle.id])[self.vehicle.id]['lat'], -34.0)
+        # los comandos no traen hora de fix
+        self.assertTrue(live.update(self.vehicle.id, {'command': 'shutdown', 'shutdown': True}))
+        self.assertTrue(live.get_many([self.vehicle.id])[self.vehicle.id]['shutdown'])
+
+    async def test_broadcaster_ignores_older_fix(self):
+        b = broadcaster.Broadcaster(tick=0, keyframe=30)
+        await b.publish(self.vehicle.id, self._payload(10, -34.0))
+        await b.publish(self.vehicle.id, self._payload(5, -35.0))
+        self.assertEqual(b.sent[self.vehicle.id][0]['lat'], -34.0)
+        self.assertEqual(b.snapshot()['stale'], 1)
+
+        b = broadcaster.Broadcaster(tick=60, keyframe=30)
+        await b.publish(self.vehicle.id, self._payload(10, -34.0))
+        await b.publish(self.vehicle.id, self._payload(5, -35.0))
+        self.assertEqual(b.pending[self.vehicle.id][1]['lat'], -34.0)
+        b.task.cancel()
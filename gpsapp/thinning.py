@@ -0,0 +1,79 @@
+import threading
+
+from django.conf import settings
+
+from .geo import haversine_m
+
+
+# vehicle_id -> último fix guardado en historial (lat, lng, speed, vehicle_on, timestamp)
+_last_kept = {}
+_lock = threading.Lock()
+counters = {'kept': 0, 'thinned': 0}
+
+
+def mark(vehicle_id: int, fixes: list) -> int:
+    """Marca con ``history=False`` los fixes redundantes de un vehículo.
+
+    Un fix se descarta del historial si está a menos de
+    ``INGEST_THIN_DISTANCE_M`` del último guardado, con la misma ignición y
+    una velocidad que no cambió más de ``INGEST_THIN_SPEED_DELTA``, salvo que
+    hayan pasado ``INGEST_THIN_HEARTBEAT`` segundos (fila de latido). La
+    posición en vivo del vehículo se actualiza igual. Devuelve los guardados.
+    """
+    if not getattr(settings, 'INGEST_THIN_ENABLED', True):
+        return len(fixes)
+    distance = getattr(settings, 'INGEST_THIN_DISTANCE_M', 15.0)
+    speed_delta = getattr(settings, 'INGEST_THIN_SPEED_DELTA', 2.0)
+    heartbeat = getattr(settings, 'INGEST_THIN_HEARTBEAT', 300)
+
+    kept = 0
+    with _lock:
+        last = _last_kept.get(vehicle_id)
+        for f in sorted(fixes, key=lambda f: f['timestamp']):
+            if (last is not None
+                    and f['vehicle_on'] == last['vehicle_on']
+                    and abs(f['speed'] - last['speed']) <= speed_delta
+                    and (f['timestamp'] - last['timestamp']).total_seconds() < heartbeat
+                    and haversine_m(last['lat'], last['lng'], f['lat'], f['lng']) < distance):
+                f['history'] = False
+                continue
+            f['history'] = True
+            last = f
+            kept += 1
+        if last is not None:
+            _last_kept[vehicle_id] = last
+        counters['kept'] += kept
+        counters['thinned'] += len(fixes) - kept
+    return kept
+
+
+def last_kept(vehicle_id: int):
+    with _lock:
+        return _last_kept.get(vehicle_id)
+
+
+def rollback(vehicle_id: int, previous, fixes: list):
+    """Deshace ``mark`` cuando los fixes no llegaron a guardarse (cola llena):
+    si no, el reintento del equipo se ralearía contra puntos que no existen."""
+    kept = sum(1 for f in fixes if f.get('history', True))
+    with _lock:
+        if previous is None:
+            _last_kept.pop(vehicle_id, None)
+        else:
+            _last_kept[vehicle_id] = previous
+        counters['kept'] -= kept
+        counters['thinned'] -= len(fixes) - kept
+
+
+def forget(vehicle_id: int):
+    with _lock:
+        _last_kept.pop(vehicle_id, None)
+
+
+def on_vehicle_deleted(sender, instance, **kwargs):
+    forget(instance.id)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return dict(counters)
@@ -0,0 +1,154 @@
+"""Segmentación de viajes y resúmenes diarios.
+
+Un viaje arranca con el primer punto activo (ignición encendida o velocidad
+de marcha) y termina en el primer punto inactivo (ignición apagada y
+detenido) o en un hueco mayor a ``HISTORY_ROLLUP_MAX_GAP``. El tiempo
+detenido con el viaje abierto cuenta como ralentí.
+
+``run_vehicle`` es incremental: retoma desde el final del último viaje
+cerrado y rehace el viaje abierto, si lo hay. ``DailySummary`` se recalcula
+sólo para los días tocados, sumando sus viajes.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+
+from . import archive
+from .geo import haversine_m
+from .models import DailySummary, Trip
+
+# por debajo de esta velocidad (km/h) el vehículo está detenido
+STOP_SPEED_KMH = 1.0
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# último punto ya procesado por vehículo cuando no quedó viaje abierto:
+# evita releer en cada corrida los latidos de un vehículo estacionado
+_processed = {}
+
+
+def _new_trip(ts, lat, lng, speed):
+    return {
+        'start': ts, 'end': ts,
+        'start_lat': lat, 'start_lng': lng, 'end_lat': lat, 'end_lng': lng,
+        'distance_m': 0.0, 'duration_s': 0.0, 'idle_s': 0.0,
+        'max_speed': speed, 'samples': 1,
+    }
+
+
+def _finish(trip, open_=False):
+    moving = trip['duration_s'] - trip['idle_s']
+    trip['avg_speed'] = trip['distance_m'] / moving * 3.6 if moving > 0 else 0.0
+    trip['open'] = open_
+    return trip
+
+
+def segment(rows, max_gap: float):
+    """Parte filas ``stores.FIELDS`` en viajes. Devuelve ``(cerrados, abierto
+    o None, timestamp del último punto)``."""
+    closed = []
+    cur = None
+    prev = None
+    for ts, lat, lng, speed, sq, on in rows:
+        active = on or speed >= STOP_SPEED_KMH
+        if cur is not None and (ts - prev[0]).total_seconds() > max_gap:
+            # el equipo dejó de reportar: el viaje termina en el último punto
+            if cur['samples'] > 1:
+                closed.append(_finish(cur))
+            cur = None
+        if cur is None:
+            if active:
+                cur = _new_trip(ts, lat, lng, speed)
+        else:
+            dt = (ts - prev[0]).total_seconds()
+            cur['distance_m'] += haversine_m(prev[1], prev[2], lat, lng)
+            cur['duration_s'] += dt
+            if prev[3] < STOP_SPEED_KMH:
+                cur['idle_s'] += dt
+            cur['end'], cur['end_lat'], cur['end_lng'] = ts, lat, lng
+            cur['max_speed'] = max(cur['max_speed'], speed)
+            cur['samples'] += 1
+            if not active:
+                closed.append(_finish(cur))
+                cur = None
+        prev = (ts, lat, lng, speed)
+    return closed, cur, prev[0] if prev else None
+
+
+def _local_day(dt):
+    return timezone.localtime(dt).date()
+
+
+def run_vehicle(vehicle_id: int, now: datetime = None, dirty_from: datetime = None) -> dict:
+    now = now or timezone.now()
+    max_gap = getattr(settings, 'HISTORY_ROLLUP_MAX_GAP', 600)
+    last = (Trip.objects.filter(vehicle_id=vehicle_id, open=False)
+            .aggregate(m=Max('end'))['m'])
+    since = last + timedelta(microseconds=1) if last else EPOCH
+    stale = Q(open=True)
+    if dirty_from is not None and last is not None and dirty_from <= last:
+        # fixes tardíos: se rehacen los viajes desde el que los contiene
+        redo_from = (Trip.objects.filter(vehicle_id=vehicle_id, end__gte=dirty_from)
+                     .aggregate(m=Min('start'))['m'])
+        since = min(redo_from or dirty_from, dirty_from)
+        stale |= Q(end__gte=dirty_from)
+        _processed.pop(vehicle_id, None)
+    done = _processed.get(vehicle_id)
+    has_open = Trip.objects.filter(vehicle_id=vehicle_id).filter(stale).exists()
+    if done and not has_open and done >= since:
+        since = done + timedelta(microseconds=1)
+
+    closed, cur, last_ts = segment(archive.query_range(vehicle_id, since, now), max_gap)
+    if cur is not None and (now - cur['end']).total_seconds() > max_gap:
+        if cur['samples'] > 1:
+            closed.append(_finish(cur))
+        cur = None
+    trips = closed + ([_finish(cur, open_=True)] if cur is not None and cur['samples'] > 1 else [])
+    if cur is None and last_ts is not None:
+        _processed[vehicle_id] = last_ts
+    else:
+        _processed.pop(vehicle_id, None)
+    if not trips and not has_open:
+        return {}
+
+    with transaction.atomic():
+        stale = Trip.objects.filter(vehicle_id=vehicle_id).filter(stale)
+        days = {_local_day(t) for t in stale.values_list('start', flat=True)}
+        stale.delete()
+        Trip.objects.bulk_create([Trip(vehicle_id=vehicle_id, **t) for t in trips])
+        days |= {_local_day(t['start']) for t in trips}
+        update_days(vehicle_id, days)
+    return {'trips': len(closed), 'open': len(trips) - len(closed), 'days': len(days)}
+
+
+def update_days(vehicle_id: int, days):
+    tz = timezone.get_current_timezone()
+    for day in days:
+        start = datetime.combine(day, datetime.min.time(), tzinfo=tz)
+        agg = (Trip.objects
+               .filter(vehicle_id=vehicle_id, start__gte=start, start__lt=start + timedelta(days=1))
+               .aggregate(trips=Count('id'), distance_m=Sum('distance_m'), duration_s=Sum('duration_s'),
+                          idle_s=Sum('idle_s'), max_speed=Max('max_speed')))
+        if not agg['trips']:
+            DailySummary.objects.filter(vehicle_id=vehicle_id, day=day).delete()
+            continue
+        driving = (agg['duration_s'] or 0.0) - (agg['idle_s'] or 0.0)
+        DailySummary.objects.update_or_create(vehicle_id=vehicle_id, day=day, defaults={
+            'trips': agg['trips'],
+            'distance_m': agg['distance_m'] or 0.0,
+            'driving_s': driving,
+            'idle_s': agg['idle_s'] or 0.0,
+            'max_speed': agg['max_speed'] or 0.0,
+            'avg_speed': (agg['distance_m'] or 0.0) / driving * 3.6 if driving > 0 else 0.0,
+        })
+
+
+def today_km(vehicle_ids) -> dict:
+    """``{vehicle_id: km}`` del día local actual (una consulta indexada)."""
+    rows = (DailySummary.objects
+            .filter(vehicle_id__in=list(vehicle_ids), day=timezone.localdate())
+            .values_list('vehicle_id', 'distance_m'))
+    return {vid: round(d / 1000, 1) for vid, d in rows}
@@ -19,7 +19,13 @@ urlpatterns = [
     path('vehicle/history', views.vehicle_history, name='vehicle_history'),
 
     path('api/update_location', views.api_update_location, name='api_update_location'),
+    path('api/update_location/batch', views.api_update_location_batch, name='api_update_location_batch'),
+    path('api/ingest/stats', views.api_ingest_stats, name='api_ingest_stats'),
     path('api/vehicle/<int:vehicle_id>/history', views.api_vehicle_history, name='api_vehicle_history'),
+    path('api/vehicle/<int:vehicle_id>/trips', views.api_vehicle_trips, name='api_vehicle_trips'),
+    path('api/vehicle/<int:vehicle_id>/daily', views.api_vehicle_daily, name='api_vehicle_daily'),
+    path('api/fleet/history', views.api_fleet_history, name='api_fleet_history'),
+    path('api/fleet/heatmap', views.api_fleet_heatmap, name='api_fleet_heatmap'),
     path('api/vehicle/<int:vehicle_id>/shutdown', views.api_shutdown_vehicle, name='api_shutdown_vehicle'),
     path('api/vehicle/<int:vehicle_id>/audio', views.api_toggle_audio, name='api_toggle_audio'),
 ]
@@ -1,6 +1,8 @@
 import json
 import logging
-from datetime import datetime
+import math
+from datetime import datetime, timedelta
+from itertools import chain, groupby, islice
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
@@ -8,15 +10,17 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.hashers import make_password
 from django.core.mail import send_mail
 from django.utils import timezone
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponse, HttpResponseRedirect
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import redirect, render
 from django.urls import reverse
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 
-from .models import User, Vehicle, LocationHistory, ContactRequest
-from .mongo import get_db as get_mongo
+from .models import User, Vehicle, ContactRequest, DailySummary, Trip
+from . import archive, encoding, heatmap, history_cache, live, rollups, simplify, streaming, thinning, trips
+from .ingest import FixError, DeviceNotFound, parse_fix, aingest, abroadcast_vehicle, writer_stats
+from .stores import decode_cursor, get_store, page
+from .protocol import BINARY_CONTENT_TYPE, NMEA_CONTENT_TYPES, decode_binary, decode_nmea, encode_reply
+from .writer import IngestQueueFull
 
 
 logger = logging.getLogger(__name__)
@@ -92,8 +96,10 @@ def contact_view(request):
 
 @login_required
 def dashboard(request):
-    vehicles = Vehicle.objects.filter(user_id=request.user.id)
-    return render(request, 'dashboard.html', {'vehicles': vehicles})
+    # campos en vivo desde gpsapp.live (la fila puede estar atrasada por el writer diferido)
+    vehicles = live.overlay(Vehicle.objects.filter(user_id=request.user.id))
+    today_km = trips.today_km(v.id for v in vehicles)
+    return render(request, 'dashboard.html', {'vehicles': vehicles, 'today_km': today_km})
 
 
 @login_required
@@ -280,6 +286,7 @@ def vehicle_map(request):
     except Vehicle.DoesNotExist:
         messages.error(request, 'Vehículo no encontrado.')
         return redirect('dashboard')
+    live.overlay([vehicle])
     vehicle_dict = {
         'id': vehicle.id,
         'lat': vehicle.lat if vehicle.lat else -34.6037,
@@ -318,16 +325,72 @@ def vehicle_history(request):
     return render(request, 'vehicle_history.html', ctx)
 
 
-def broadcast_vehicle(vehicle_id: int, payload: dict):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"vehicle_{vehicle_id}",
-        {"type": "vehicle.event", "data": payload}
-    )
+@csrf_exempt
+async def api_update_location(request):
+    # Content-Type: application/json (por defecto), application/octet-stream
+    # (registro binario, ver gpsapp.protocol) o text/x-nmea (?device_id=...)
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Método no permitido'}, status=405)
+
+    ctype = request.content_type
+    if ctype == BINARY_CONTENT_TYPE:
+        try:
+            device_id, fixes = decode_binary(request.body)
+        except FixError as e:
+            return HttpResponse(str(e), status=400, content_type='text/plain')
+        try:
+            v, now_str, _ = await aingest(device_id, fixes)
+        except DeviceNotFound:
+            return HttpResponse(status=404)
+        except IngestQueueFull:
+            return HttpResponse(status=429)
+        return HttpResponse(encode_reply(v.shutdown, v.transmit_audio), content_type=BINARY_CONTENT_TYPE)
+
+    if ctype in NMEA_CONTENT_TYPES:
+        device_id = request.GET.get('device_id')
+        if not device_id:
+            return JsonResponse({'status': 'error', 'message': 'Faltan datos requeridos.'}, status=400)
+        try:
+            fixes = decode_nmea(
+                request.body.decode('ascii', errors='ignore'),
+                signal_quality=int(request.GET.get('signal_quality', 0)),
+                vehicle_on=request.GET.get('vehicle_on') in ('1', 'true'),
+            )
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Señal inválida.'}, status=400)
+    else:
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except Exception:
+            return JsonResponse({'status': 'error', 'message': 'JSON inválido'}, status=400)
+
+        device_id = data.get('device_id')
+        if not device_id:
+            return JsonResponse({'status': 'error', 'message': 'Faltan datos requeridos.'}, status=400)
+        try:
+            fixes = [parse_fix(data)]
+        except FixError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    # la escritura a SQLite/Mongo queda en la cola de fondo
+    try:
+        v, now_str, _ = await aingest(device_id, fixes)
+    except DeviceNotFound:
+        return JsonResponse({'status': 'error', 'message': 'Dispositivo no encontrado.'}, status=404)
+    except IngestQueueFull:
+        return JsonResponse({'status': 'error', 'message': 'Servidor ocupado, reintentar.'}, status=429)
+
+    return JsonResponse({
+        'status': 'success',
+        'shutdown': bool(v.shutdown),
+        'transmit_audio': bool(v.transmit_audio),
+        'last_updated': now_str,
+    })
 
 
 @csrf_exempt
-def api_update_location(request):
+async def api_update_location_batch(request):
+    # {"device_id": "...", "fixes": [{"lat": .., "lng": .., "speed": .., "signal_quality": .., "vehicle_on": .., "ts": epoch}, ...]}
     if request.method != 'POST':
         return JsonResponse({'status': 'error', 'message': 'Método no permitido'}, status=405)
     try:
@@ -336,96 +399,85 @@ def api_update_location(request):
         return JsonResponse({'status': 'error', 'message': 'JSON inválido'}, status=400)
 
     device_id = data.get('device_id')
-    lat = data.get('lat')
-    lng = data.get('lng')
-    speed = data.get('speed', 0.0)
-    signal_quality = data.get('signal_quality', 0)
-    vehicle_on = data.get('vehicle_on', False)
-
-    if not all([device_id, lat, lng]):
+    raw_fixes = data.get('fixes')
+    if not device_id or not isinstance(raw_fixes, list) or not raw_fixes:
         return JsonResponse({'status': 'error', 'message': 'Faltan datos requeridos.'}, status=400)
-    try:
-        lat = float(lat)
-        lng = float(lng)
-        speed = float(speed)
-        signal_quality = int(signal_quality)
-    except Exception:
-        return JsonResponse({'status': 'error', 'message': 'Lat/Lng/Velocidad/Señal inválidos.'}, status=400)
-
-    try:
-        v = Vehicle.objects.get(device_id=device_id)
-    except Vehicle.DoesNotExist:
-        return JsonResponse({'status': 'error', 'message': 'Dispositivo no encontrado.'}, status=404)
+    max_fixes = getattr(settings, 'INGEST_BATCH_MAX_FIXES', 500)
+    if len(raw_fixes) > max_fixes:
+        return JsonResponse({'status': 'error', 'message': f'Máximo {max_fixes} posiciones por lote.'}, status=413)
 
-    # actualizar
-    now_str = datetime.now().strftime('%d-%m-%Y %H:%M')
-    if lat != 0.0 or lng != 0.0:
-        v.lat = lat
-        v.lng = lng
-        v.speed = speed
-        v.signal_quality = signal_quality
-        v.vehicle_on = bool(vehicle_on)
-        v.last_updated = now_str
-        v.save()
-        LocationHistory.objects.create(
-            vehicle=v, lat=lat, lng=lng, speed=speed,
-            signal_quality=signal_quality, vehicle_on=bool(vehicle_on)
-        )
+    fixes = []
+    for raw in raw_fixes:
         try:
-            mdb = get_mongo()
-            mdb.location_history.insert_one({
-                'vehicle_id': v.id,
-                'lat': lat,
-                'lng': lng,
-                'speed': speed,
-                'signal_quality': signal_quality,
-                'vehicle_on': bool(vehicle_on),
-                'timestamp': datetime.utcnow(),
-            })
-            mdb.vehicles.update_one(
-                {'vehicle_id': v.id},
-                {'$set': {
-                    'lat': lat,
-                    'lng': lng,
-                    'speed': speed,
-                    'signal_quality': signal_quality,
-                    'vehicle_on': bool(vehicle_on),
-                    'last_updated': now_str,
-                }},
-                upsert=True
-            )
-        except Exception:
-            pass
-
-    # broadcast
-    payload = {
-        'vehicle_id': str(v.id),
-        'lat': lat,
-        'lng': lng,
-        'speed': speed,
-        'signal_quality': signal_quality,
-        'vehicle_on': bool(vehicle_on),
-        'shutdown': bool(v.shutdown),
-        'transmit_audio': bool(v.transmit_audio),
-        'last_updated': now_str,
-    }
+            fixes.append(parse_fix(raw if isinstance(raw, dict) else {}))
+        except FixError:
+            continue
+
     try:
-        broadcast_vehicle(v.id, payload)
-    except Exception:
-        pass
+        v, now_str, stored = await aingest(device_id, fixes)
+    except DeviceNotFound:
+        return JsonResponse({'status': 'error', 'message': 'Dispositivo no encontrado.'}, status=404)
+    except IngestQueueFull:
+        return JsonResponse({'status': 'error', 'message': 'Servidor ocupado, reintentar.'}, status=429)
 
     return JsonResponse({
         'status': 'success',
+        'accepted': len(fixes),
+        'rejected': len(raw_fixes) - len(fixes),
+        'stored': stored,
         'shutdown': bool(v.shutdown),
         'transmit_audio': bool(v.transmit_audio),
         'last_updated': now_str,
     })
 
 
+@login_required
+def api_ingest_stats(request):
+    if request.user.role != 'admin':
+        return JsonResponse({'status': 'error', 'message': 'Acceso denegado.'}, status=403)
+    return JsonResponse({'status': 'success', 'ingest': writer_stats(), 'thinning': thinning.snapshot(),
+                         'history_cache': history_cache.snapshot()})
+
+
+def _parse_dt(s, default):
+    if not s:
+        return default
+    for f in ('%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return timezone.make_aware(datetime.strptime(s, f))
+        except Exception:
+            continue
+    return default
+
+
+def _parse_zoom(s):
+    # zoom de Leaflet; nan/inf no, y fuera de 0–MAX_ZOOM se acota
+    zoom = float(s)
+    if not math.isfinite(zoom):
+        raise ValueError(s)
+    return min(max(zoom, 0.0), simplify.MAX_ZOOM)
+
+
+def _parse_simplify(params):
+    # tolerance (metros, > 0) o zoom piden el recorrido simplificado
+    tolerance = float(params['tolerance']) if params.get('tolerance') else None
+    if tolerance is not None and not (math.isfinite(tolerance) and tolerance > 0):
+        raise ValueError(params['tolerance'])
+    zoom = _parse_zoom(params['zoom']) if params.get('zoom') else None
+    return tolerance, zoom
+
+
+def _parse_range(from_s, to_s):
+    # from=YYYY-MM-DD[THH:MM], to=... (hora local); por defecto, hoy
+    default_to = timezone.localtime()
+    default_from = default_to.replace(hour=0, minute=0, second=0, microsecond=0)
+    return _parse_dt(from_s, default_from), _parse_dt(to_s, default_to)
+
+
 @login_required
 def api_vehicle_history(request, vehicle_id: int):
-    # formateo fechas: from=YYYY-MM-DD[THH:MM], to=...
-    src = request.GET.get('source', 'mongo')
+    # formateo fechas: from=YYYY-MM-DD[THH:MM], to=... (hora local)
+    src = request.GET.get('source')
     fmt = request.GET.get('format', 'json')
     from_s = request.GET.get('from')
     to_s = request.GET.get('to')
@@ -434,97 +486,247 @@ def api_vehicle_history(request, vehicle_id: int):
     except Vehicle.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Vehículo no encontrado.'}, status=404)
 
-    def parse_dt(s, default):
-        if not s:
-            return default
-        for f in ('%Y-%m-%dT%H:%M', '%Y-%m-%d'):
-            try:
-                return datetime.strptime(s, f)
-            except Exception:
-                continue
-        return default
-
-    default_from = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    default_to = datetime.now()
-    dt_from = parse_dt(from_s, default_from)
-    dt_to = parse_dt(to_s, default_to)
+    dt_from, dt_to = _parse_range(from_s, to_s)
 
-    # Ajuste a UTC para Mongo (guardamos con datetime.utcnow())
+    # tolerance (metros) o zoom (Leaflet) piden el recorrido simplificado
     try:
-        tz_offset = datetime.utcnow() - datetime.now()
-    except Exception:
-        tz_offset = None
-    dt_from_utc = dt_from + tz_offset if tz_offset else dt_from
-    dt_to_utc = dt_to + tz_offset if tz_offset else dt_to
-
-    points = []
-    if src == 'mongo':
+        tolerance, zoom = _parse_simplify(request.GET)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Tolerancia o zoom inválidos.'}, status=400)
+    simplified = tolerance is not None or zoom is not None
+    # limit + cursor: paginación keyset (sólo resolución cruda)
+    try:
+        limit = min(int(request.GET['limit']), settings.HISTORY_PAGE_MAX) if request.GET.get('limit') else None
+        after = decode_cursor(request.GET['cursor']) if request.GET.get('cursor') else None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Límite o cursor inválidos.'}, status=400)
+    if limit is not None and limit < 1:
+        return JsonResponse({'status': 'error', 'message': 'Límite o cursor inválidos.'}, status=400)
+    head = {'status': 'success'}
+
+    resolution = rollups.pick_resolution(request.GET.get('resolution', 'auto'), dt_from, dt_to)
+    head['resolution'] = resolution
+    if resolution != 'raw':
+        points = rollups.query_rollups(vehicle_id, resolution, dt_from, dt_to)
+        if simplified:
+            keep, _, _ = simplify.simplify_rows(
+                [(i, p['lat'], p['lng'], p['speed'], 0, p['vehicle_on']) for i, p in enumerate(points)],
+                tolerance, zoom)
+            head['original_count'] = len(points)
+            head['distance_m'] = sum(p['distance_m'] for p in points)
+            points = [points[i] for i, *_ in keep]
+        rows = ((datetime.fromisoformat(p['timestamp']), p['lat'], p['lng'], p['speed'],
+                 p['signal_quality'], p['vehicle_on']) for p in points)
+    else:
+        # los días ya archivados se leen del archivo columnar
+        if after is not None:
+            dt_from = max(dt_from, after[0])
+        store = get_store(src)
+        rows = history_cache.query_range(vehicle_id, dt_from, dt_to, store)
         try:
-            mdb = get_mongo()
-            cur = mdb.location_history.find({
-                'vehicle_id': vehicle_id,
-                'timestamp': {'$gte': dt_from_utc, '$lte': dt_to_utc}
-            }).sort('timestamp', 1)
-            for doc in cur:
-                points.append({
-                    'lat': float(doc.get('lat', 0)),
-                    'lng': float(doc.get('lng', 0)),
-                    'speed': float(doc.get('speed', 0)),
-                    'signal_quality': int(doc.get('signal_quality', 0)),
-                    'vehicle_on': bool(doc.get('vehicle_on', False)),
-                    'timestamp': doc.get('timestamp').isoformat() if doc.get('timestamp') else ''
-                })
+            # el primer pedazo se lee antes de responder: si el store falla
+            # todavía se puede caer al primario
+            first = list(islice(rows, streaming.CHUNK_POINTS))
         except Exception:
-            # fall back to sqlite
-            src = 'sqlite'
-
-    # Fallback: si Mongo no trajo puntos, probar en SQLite también
-    if not points and src == 'mongo':
-        qs = LocationHistory.objects.filter(vehicle_id=vehicle_id, timestamp__gte=dt_from, timestamp__lte=dt_to).order_by('timestamp')
-        for r in qs:
-            points.append({
-                'lat': float(r.lat), 'lng': float(r.lng), 'speed': float(r.speed),
-                'signal_quality': int(r.signal_quality), 'vehicle_on': bool(r.vehicle_on),
-                'timestamp': r.timestamp.isoformat()
-            })
-
-    if src == 'sqlite':
-        qs = LocationHistory.objects.filter(vehicle_id=vehicle_id, timestamp__gte=dt_from, timestamp__lte=dt_to).order_by('timestamp')
-        for r in qs:
-            points.append({
-                'lat': float(r.lat), 'lng': float(r.lng), 'speed': float(r.speed),
-                'signal_quality': int(r.signal_quality), 'vehicle_on': bool(r.vehicle_on),
-                'timestamp': r.timestamp.isoformat()
-            })
+            logger.warning('Falló la lectura de historial desde %s; se usa el primario', store.name)
+            rows = archive.query_range(vehicle_id, dt_from, dt_to)
+            first = []
+        rows = chain(first, rows)
+        if limit is not None:
+            rows, head['next'] = page(rows, limit, after)
+        if simplified:
+            # Douglas–Peucker necesita el recorrido entero; se arma en columnas
+            rows, head['original_count'], head['distance_m'] = simplify.simplify_rows(rows, tolerance, zoom)
+        points = (
+            {
+                'lat': lat, 'lng': lng, 'speed': speed,
+                'signal_quality': sq, 'vehicle_on': on,
+                'timestamp': ts.isoformat(),
+            }
+            for ts, lat, lng, speed, sq, on in rows
+        )
+
+    # formatos compactos: se arman por columnas desde las filas, sin dicts por punto
+    if fmt == 'columnar':
+        head.update(encoding.columnar(rows))
+        return JsonResponse(head)
+    if fmt == 'polyline':
+        try:
+            precision = int(request.GET.get('precision', 5))
+        except ValueError:
+            precision = 5
+        head.update(encoding.polyline(rows, min(max(precision, 1), 7)))
+        return JsonResponse(head)
 
     if fmt == 'csv':
-        import csv
-        from io import StringIO
-        sio = StringIO()
-        w = csv.writer(sio)
-        w.writerow(['timestamp','lat','lng','speed','signal_quality','vehicle_on'])
-        for p in points:
-            w.writerow([p['timestamp'], p['lat'], p['lng'], p['speed'], p['signal_quality'], int(p['vehicle_on'])])
-        from django.http import HttpResponse
-        resp = HttpResponse(sio.getvalue(), content_type='text/csv')
+        resp = streaming.stream(request, streaming.csv_chunks(points), 'text/csv')
         resp['Content-Disposition'] = f'attachment; filename="vehicle_{vehicle_id}_history.csv"'
+        if head.get('next'):
+            resp['X-Next-Cursor'] = head['next']
         return resp
 
-    return JsonResponse({'status': 'success', 'points': points})
+    return streaming.stream(
+        request,
+        streaming.json_chunks(head, 'points', points),
+        'application/json',
+    )
+
+
+@login_required
+def api_fleet_history(request):
+    # vehicles=1,2,3 (vacío: todos los del usuario); from/to como en el historial,
+    # por defecto la última hora. Un solo IN para la propiedad y otro para los puntos.
+    fmt = request.GET.get('format', 'columnar')
+    if fmt not in ('columnar', 'polyline'):
+        return JsonResponse({'status': 'error', 'message': 'Formato inválido.'}, status=400)
+    try:
+        wanted = {int(v) for v in request.GET.get('vehicles', '').split(',') if v.strip()}
+        tolerance, zoom = _parse_simplify(request.GET)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Parámetros inválidos.'}, status=400)
+    default_to = timezone.localtime()
+    dt_from = _parse_dt(request.GET.get('from'), default_to - timedelta(hours=1))
+    dt_to = _parse_dt(request.GET.get('to'), default_to)
+    if dt_to < dt_from or dt_to - dt_from > timedelta(hours=settings.HISTORY_FLEET_MAX_SPAN_HOURS):
+        return JsonResponse({'status': 'error', 'message': 'Rango inválido: máximo %d horas.'
+                             % settings.HISTORY_FLEET_MAX_SPAN_HOURS}, status=400)
+
+    owned = Vehicle.objects.filter(user_id=request.user.id)
+    if wanted:
+        owned = owned.filter(id__in=wanted)
+    vehicles = {
+        v['id']: v for v in owned.values('id', 'name', 'patente', 'lat', 'lng', 'speed',
+                                         'signal_quality', 'vehicle_on', 'last_updated')
+    }
+    # campos en vivo desde gpsapp.live, como en dashboard (la fila puede estar atrasada)
+    for vid, state in live.get_many(vehicles).items():
+        vehicles[vid].update({k: value for k, value in state.items() if k in vehicles[vid]})
+    out = {vid: {'position': pos, 'count': 0} for vid, pos in vehicles.items()}
+    if vehicles:
+        store = get_store(request.GET.get('source'))
+        try:
+            rows = list(archive.query_many(vehicles, dt_from, dt_to, store))
+        except Exception:
+            logger.warning('Falló la lectura de historial de flota desde %s; se usa el primario', store.name)
+            rows = list(archive.query_many(vehicles, dt_from, dt_to))
+        precision = 5
+        if fmt == 'polyline':
+            try:
+                precision = min(max(int(request.GET.get('precision', 5)), 1), 7)
+            except ValueError:
+                pass
+        for vid, group in groupby(rows, key=lambda r: r[0]):
+            track = [r[1:] for r in group]
+            entry = out[vid]
+            if tolerance is not None or zoom is not None:
+                track, entry['original_count'], entry['distance_m'] = simplify.simplify_rows(track, tolerance, zoom)
+            entry.update(encoding.polyline(track, precision) if fmt == 'polyline' else encoding.columnar(track))
+
+    return JsonResponse({
+        'status': 'success',
+        'from': dt_from.isoformat(),
+        'to': dt_to.isoformat(),
+        'vehicles': {str(vid): entry for vid, entry in out.items()},
+        'not_found': sorted(wanted - vehicles.keys()),
+    })
+
+
+@login_required
+def api_fleet_heatmap(request):
+    # bbox=min_lng,min_lat,max_lng,max_lat & zoom (Leaflet); from/to=YYYY-MM-DD,
+    # por defecto los últimos 30 días; vehicles=1,2,3 (vacío: todos)
+    today = timezone.localdate()
+    try:
+        bbox = [float(x) for x in request.GET['bbox'].split(',')]
+        zoom = _parse_zoom(request.GET.get('zoom', '12'))
+        wanted = {int(v) for v in request.GET.get('vehicles', '').split(',') if v.strip()}
+        day_from = datetime.strptime(request.GET['from'], '%Y-%m-%d').date() if request.GET.get('from') else today - timedelta(days=29)
+        day_to = datetime.strptime(request.GET['to'], '%Y-%m-%d').date() if request.GET.get('to') else today
+    except (KeyError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Parámetros inválidos.'}, status=400)
+    if len(bbox) != 4 or not all(math.isfinite(x) for x in bbox) or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        return JsonResponse({'status': 'error', 'message': 'Parámetros inválidos.'}, status=400)
+    # Leaflet puede pedir más allá del antimeridiano o de los polos
+    bbox = [max(bbox[0], -180.0), max(bbox[1], -90.0), min(bbox[2], 180.0), min(bbox[3], 90.0)]
+    if day_to < day_from or (day_to - day_from).days >= settings.HEATMAP_MAX_DAYS:
+        return JsonResponse({'status': 'error', 'message': 'Rango inválido: máximo %d días.'
+                             % settings.HEATMAP_MAX_DAYS}, status=400)
+    if heatmap.output_cells(bbox, zoom) > settings.HEATMAP_MAX_CELLS:
+        return JsonResponse({'status': 'error', 'message': 'Área demasiado grande para el zoom pedido.'}, status=400)
+
+    owned = Vehicle.objects.filter(user_id=request.user.id)
+    if wanted:
+        owned = owned.filter(id__in=wanted)
+    vehicle_ids = list(owned.values_list('id', flat=True))
+    cells = heatmap.query(vehicle_ids, day_from, day_to, bbox, zoom)
+    return JsonResponse({
+        'status': 'success',
+        'from': day_from.isoformat(),
+        'to': day_to.isoformat(),
+        **cells,
+        'not_found': sorted(wanted - set(vehicle_ids)),
+    })
+
+
+@login_required
+def api_vehicle_trips(request, vehicle_id: int):
+    if not Vehicle.objects.filter(id=vehicle_id, user_id=request.user.id).exists():
+        return JsonResponse({'status': 'error', 'message': 'Vehículo no encontrado.'}, status=404)
+    dt_from, dt_to = _parse_range(request.GET.get('from'), request.GET.get('to'))
+    rows = (Trip.objects
+            .filter(vehicle_id=vehicle_id, start__gte=dt_from, start__lte=dt_to)
+            .order_by('start'))
+    out = [
+        {
+            'start': t.start.isoformat(), 'end': t.end.isoformat(),
+            'start_lat': t.start_lat, 'start_lng': t.start_lng,
+            'end_lat': t.end_lat, 'end_lng': t.end_lng,
+            'distance_m': t.distance_m, 'duration_s': t.duration_s, 'idle_s': t.idle_s,
+            'max_speed': t.max_speed, 'avg_speed': t.avg_speed, 'open': t.open,
+        }
+        for t in rows
+    ]
+    return JsonResponse({'status': 'success', 'trips': out})
+
+
+@login_required
+def api_vehicle_daily(request, vehicle_id: int):
+    if not Vehicle.objects.filter(id=vehicle_id, user_id=request.user.id).exists():
+        return JsonResponse({'status': 'error', 'message': 'Vehículo no encontrado.'}, status=404)
+    # por defecto, los últimos 30 días
+    today = timezone.localdate()
+    try:
+        day_from = datetime.strptime(request.GET['from'], '%Y-%m-%d').date() if request.GET.get('from') else today - timedelta(days=29)
+        day_to = datetime.strptime(request.GET['to'], '%Y-%m-%d').date() if request.GET.get('to') else today
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Fecha inválida.'}, status=400)
+    rows = (DailySummary.objects
+            .filter(vehicle_id=vehicle_id, day__gte=day_from, day__lte=day_to)
+            .order_by('day'))
+    days = [
+        {
+            'day': d.day.isoformat(), 'trips': d.trips, 'distance_m': d.distance_m,
+            'driving_s': d.driving_s, 'idle_s': d.idle_s,
+            'max_speed': d.max_speed, 'avg_speed': d.avg_speed,
+        }
+        for d in rows
+    ]
+    return JsonResponse({'status': 'success', 'days': days})
 
 
 @csrf_exempt
 @login_required
-def api_shutdown_vehicle(request, vehicle_id: int):
+async def api_shutdown_vehicle(request, vehicle_id: int):
+    user = await request.auser()
     try:
-        v = Vehicle.objects.get(id=vehicle_id, user_id=request.user.id)
+        v = await Vehicle.objects.aget(id=vehicle_id, user_id=user.id)
     except Vehicle.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Vehículo no encontrado.'}, status=404)
     v.shutdown = not v.shutdown
-    v.save()
+    await v.asave(update_fields=['shutdown'])
     payload = {'vehicle_id': str(v.id), 'command': 'shutdown' if v.shutdown else 'turn_on', 'shutdown': bool(v.shutdown)}
     try:
-        broadcast_vehicle(v.id, payload)
+        await abroadcast_vehicle(v.id, payload, v.user_id)
     except Exception:
         pass
     return JsonResponse({'status': 'success', 'message': 'Ok', 'shutdown': bool(v.shutdown), 'transmit_audio': bool(v.transmit_audio)})
@@ -532,16 +734,17 @@ def api_shutdown_vehicle(request, vehicle_id: int):
 
 @csrf_exempt
 @login_required
-def api_toggle_audio(request, vehicle_id: int):
+async def api_toggle_audio(request, vehicle_id: int):
+    user = await request.auser()
     try:
-        v = Vehicle.objects.get(id=vehicle_id, user_id=request.user.id)
+        v = await Vehicle.objects.aget(id=vehicle_id, user_id=user.id)
     except Vehicle.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Vehículo no encontrado.'}, status=404)
     v.transmit_audio = not v.transmit_audio
-    v.save()
+    await v.asave(update_fields=['transmit_audio'])
     payload = {'vehicle_id': str(v.id), 'command': 'transmit_audio' if v.transmit_audio else 'stop_audio', 'transmit_audio': bool(v.transmit_audio)}
     try:
-        broadcast_vehicle(v.id, payload)
+        await abroadcast_vehicle(v.id, payload, v.user_id)
     except Exception:
         pass
     return JsonResponse({'status': 'success', 'message': 'Ok', 'transmit_audio': bool(v.transmit_audio), 'audio_url': 'simulated_audio.mp3' if v.transmit_audio else None})
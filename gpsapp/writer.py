@@ -0,0 +1,131 @@
+import logging
+import queue
+import threading
+import time
+
+from django.db import close_old_connections, connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class HistoryWriter:
+    """Cola acotada de escritura diferida (write-behind).
+
+    Cada elemento encolado es una lista de entradas que ``sink`` sabe
+    persistir. Un hilo de fondo junta elementos hasta ``flush_max`` entradas
+    o ``flush_interval`` segundos y llama a ``sink`` una vez por lote.
+    """
+
+    def __init__(self, sink, maxsize=10000, flush_interval=1.0, flush_max=500):
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.flush_interval = flush_interval
+        self.flush_max = flush_max
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.counters = {
+            'enqueued': 0,
+            'rejected': 0,
+            'written': 0,
+            'failed': 0,
+            'batches': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, entries: list):
+        if not entries:
+            return
+        if self._thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(entries)
+        except queue.Full:
+            with self._lock:
+                self.counters['rejected'] += len(entries)
+            raise IngestQueueFull()
+        with self._lock:
+            self.counters['enqueued'] += len(entries)
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                # sigue escribiendo: drenar acá correría el sink en dos hilos a la vez
+                logger.warning('El writer no terminó en %.0fs; quedan %d lotes en cola', timeout, self.queue.qsize())
+                return
+        # lo que haya quedado (p.ej. si el hilo nunca arrancó) se escribe acá
+        while True:
+            batch = self._collect(block=False)
+            if not batch:
+                break
+            self._write(batch)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            data = dict(self.counters)
+        data['queue_depth'] = self.queue.qsize()
+        data['queue_maxsize'] = self.queue.maxsize
+        data['running'] = bool(self._thread and self._thread.is_alive())
+        return data
+
+    def _collect(self, block=True) -> list:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_max:
+            try:
+                if block:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self._stop.is_set():
+                        break
+                    # despierta seguido para que stop() no espere el flush_interval entero
+                    item = self.queue.get(timeout=min(remaining, 0.2))
+                else:
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                if block and time.monotonic() < deadline and not self._stop.is_set():
+                    continue
+                break
+            batch.extend(item)
+        return batch
+
+    def _write(self, batch: list):
+        try:
+            self.sink(batch)
+        except Exception:
+            logger.exception('Falló la escritura diferida de %d posiciones', len(batch))
+            with self._lock:
+                self.counters['failed'] += len(batch)
+            return
+        with self._lock:
+            self.counters['written'] += len(batch)
+            self.counters['batches'] += 1
+            self.counters['last_batch_size'] = len(batch)
+            self.counters['max_batch_size'] = max(self.counters['max_batch_size'], len(batch))
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                close_old_connections()
+                self._write(batch)
+        while True:
+            batch = self._collect(block=False)
+            if not batch:
+                break
+            self._write(batch)
+        connections.close_all()